@@ -5,10 +5,18 @@ from .cityscapes import (
     CITYSCAPES_COLORS,
     CITYSCAPES_FULL_COLORS,
     CITYSCAPES_FULL_LABELS,
+    CITYSCAPES_FULL_TO_CATEGORY_LUT,
+    CITYSCAPES_FULL_TO_TRAIN_LUT,
     CITYSCAPES_LABELS,
     CityscapesSubset,
 )
-from .coco_stuff import COCO_FULL_LABELS, COCO_STUFF_LABELS, COCO_VOC_LABELS, COCOStuff
+from .coco_stuff import (
+    COCO_FULL_LABELS,
+    COCO_STUFF_LABELS,
+    COCO_STUFF_TO_VOC_LUT,
+    COCO_VOC_LABELS,
+    COCOStuff,
+)
 from .dataset_registry import (
     DATASET_METADATA,
     DATASET_ZOO,
@@ -22,6 +30,7 @@ from .mapillary import (
     MAPILLARY_COLORS,
     MAPILLARY_FULL_COLORS,
     MAPILLARY_FULL_LABELS,
+    MAPILLARY_FULL_TO_TRAIN_LUT,
     MAPILLARY_LABELS,
     MapillaryVistas,
 )
@@ -47,6 +47,16 @@ CITYSCAPES_COLORS = tuple([CITYSCAPES_FULL_COLORS[i] for i in _TRAIN_IDS] + [(0,
 _cat_groups = tuple(_CATEGORY_IDS.values())
 CITYSCAPES_CATEGORY_LABELS = tuple(_CATEGORY_IDS.keys()) + ("background",)
 
+# look-up tables from full ids, see `utils.metrics.fold_confusion_matrix`
+CITYSCAPES_FULL_TO_TRAIN_LUT = tuple(
+    _TRAIN_IDS.index(i) if i in _TRAIN_IDS else 19
+    for i in range(len(CITYSCAPES_FULL_LABELS))
+)
+CITYSCAPES_FULL_TO_CATEGORY_LUT = tuple(
+    next((j for j, ids in enumerate(_cat_groups) if i in ids), 7)
+    for i in range(len(CITYSCAPES_FULL_LABELS))
+)
+
 
 register_dataset(
     {"target_type": "semantic", "split": "train"},
@@ -49,6 +49,11 @@ _VOC_IDS = (0, 1, 2, 4, 5, 6, 8, 15, 16, 17, 18, 19, 20, 43, 61, 62, 63, 66, 71)
 COCO_STUFF_LABELS = tuple([COCO_FULL_LABELS[i] for i in _kept_ids] + ["unlabeled"])
 COCO_VOC_LABELS = tuple([COCO_FULL_LABELS[i] for i in _VOC_IDS] + ["unlabeled"])
 
+# look-up table from COCO_STUFF_LABELS, see `utils.metrics.fold_confusion_matrix`
+COCO_STUFF_TO_VOC_LUT = tuple(
+    [_VOC_IDS.index(i) if i in _VOC_IDS else 19 for i in _kept_ids] + [19]
+)
+
 
 @register_dataset(
     {"split": "train", "include_ids": _VOC_IDS, "extra_id": 19},
@@ -87,6 +87,12 @@ _train_ids = tuple(
 MAPILLARY_LABELS = tuple([MAPILLARY_FULL_LABELS[i] for i in _train_ids])
 MAPILLARY_COLORS = tuple([MAPILLARY_FULL_COLORS[i] for i in _train_ids])
 
+# look-up table from full ids, see `utils.metrics.fold_confusion_matrix`
+MAPILLARY_FULL_TO_TRAIN_LUT = tuple(
+    _train_ids.index(i) if i in _train_ids else 255
+    for i in range(len(MAPILLARY_FULL_LABELS))
+)
+
 
 @register_dataset(
     {"split": "training"},
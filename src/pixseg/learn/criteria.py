@@ -60,7 +60,8 @@ class DiceLoss(_WeightedLoss):
 
     def forward(self, input: Tensor, target: Tensor) -> Tensor:
         num_classes = input.size(1)
-        input = F.softmax(input, dim=1)
+        # sums of probabilities are inaccurate in lower precision
+        input = F.softmax(input.float(), dim=1)
         target_one_hot = torch.stack([target == i for i in range(num_classes)], dim=1)
         target_one_hot = target_one_hot.to(torch.float)
 
@@ -134,8 +135,9 @@ class FocalLoss(_WeightedLoss):
         self.label_smoothing = label_smoothing
 
     def forward(self, input: Tensor, target: Tensor) -> Tensor:
+        # exp amplifies rounding errors of lower precision
         ce = F.cross_entropy(
-            input,
+            input.float(),
             target,
             self.weight,
             ignore_index=self.ignore_index,
@@ -23,6 +23,7 @@ from .model_registry import (
     list_models,
     register_model,
 )
+from .model_utils import build_from_state_dict, set_activation_checkpointing
 from .pspnet import PSPNet, PSPNET_ResNet50_Weights, pspnet_resnet50
 from .sfnet import (
     SFNet,
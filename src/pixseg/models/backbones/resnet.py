@@ -1,20 +1,42 @@
+from collections import OrderedDict
 from typing import cast
 
-from torch import nn
+from torch import Tensor, nn
 from torchvision.models import resnet
 from torchvision.models._utils import IntermediateLayerGetter
 
+from ..model_utils import checkpoint_forward, is_checkpointing
+
 
 class ResNetBackbone(IntermediateLayerGetter):
     """
     For resnet50, resnet101 and resnet152, recommend to build with
     `replace_stride_with_dilation=[False, True, True]`
+
+    Support activation checkpointing of each block in the layers
     """
 
+    checkpoint_segment = "backbone"
+
     def __init__(self, model: resnet.ResNet) -> None:
         layers = [f"layer{i+1}" for i in range(4)]
         return_layers = {layer: layer for layer in layers}
         super().__init__(model, return_layers)
+        self.activation_checkpointing = False
+
+    def forward(self, x: Tensor) -> dict[str, Tensor]:
+        if not is_checkpointing(self):
+            return super().forward(x)
+        out: dict[str, Tensor] = OrderedDict()
+        for name, module in self.items():
+            if isinstance(module, nn.Sequential):
+                for block in module:
+                    x = checkpoint_forward(block, x)
+            else:
+                x = module(x)
+            if name in self.return_layers:
+                out[self.return_layers[name]] = x
+        return out
 
     def layer_channels(self) -> dict[str, int]:
         num_channels: dict[str, int] = {}
@@ -3,6 +3,7 @@ from torch.hub import load_state_dict_from_url
 from torchvision.models._utils import IntermediateLayerGetter
 
 from ..model_registry import SegWeights, SegWeightsEnum
+from ..model_utils import checkpoint_forward, is_checkpointing
 
 
 #####
@@ -28,6 +29,10 @@ class SeparableConv(nn.Sequential):
 
 
 class ResidualBlock(nn.Module):
+    """Support activation checkpointing"""
+
+    checkpoint_segment = "backbone"
+
     def __init__(
         self,
         num_channels: list[int],
@@ -64,8 +69,14 @@ class ResidualBlock(nn.Module):
         if pool_at_end:
             main_branch.append(nn.MaxPool2d(3, stride=2, padding=1))
         self.main_branch = nn.Sequential(*main_branch)
+        self.activation_checkpointing = False
 
     def forward(self, x: Tensor):
+        if is_checkpointing(self):
+            return checkpoint_forward(self, x, forward=self._forward)
+        return self._forward(x)
+
+    def _forward(self, x: Tensor):
         main_out = self.main_branch(x)
         residual_out = self.residual_branch(x)
         return main_out + residual_out
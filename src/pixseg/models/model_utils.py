@@ -1,9 +1,14 @@
+import itertools
 import typing
+from contextlib import contextmanager, nullcontext
 from enum import Enum
 from inspect import signature
-from typing import Any, Callable, ParamSpec, TypeVar
+from typing import Any, Callable, Iterable, ParamSpec, TypeVar
 
-from torch import nn
+import torch
+from torch import Tensor, nn
+from torch.nn.modules.batchnorm import _BatchNorm
+from torch.utils.checkpoint import checkpoint
 
 from .model_registry import SegWeights
 
@@ -80,3 +85,100 @@ Args:
         return func
 
     return wrapper
+
+
+def build_from_state_dict(
+    builder: Callable[..., T], state_dict: dict[str, Tensor], **kwargs
+) -> T | None:
+    """Build model on the meta device and assign the tensors of :param:`state_dict`
+    as its parameters and buffers. Weight initialization and pretrained backbone are
+    skipped, and the tensors are not copied, e.g. memory-mapped tensors stay lazy
+
+    Returns:
+        `None` if :param:`state_dict` does not match the keys, shapes and dtypes of the
+        model exactly, e.g. weights saved in half precision. Build the model normally
+        and transfer the weights instead, which casts them
+    """
+    if "weights_backbone" in signature(builder).parameters:
+        kwargs["weights_backbone"] = None
+    with torch.device("meta"):
+        model = builder(**kwargs)
+
+    model_state = model.state_dict()
+    if model_state.keys() != state_dict.keys() or any(
+        v.shape != state_dict[k].shape or v.dtype != state_dict[k].dtype
+        for k, v in model_state.items()
+    ):
+        return None
+    model.load_state_dict(state_dict, assign=True)
+    # e.g. non-persistent buffers are not in state dict
+    if any(t.is_meta for t in itertools.chain(model.parameters(), model.buffers())):
+        return None
+    return model
+
+
+def set_activation_checkpointing(
+    model: nn.Module, segments: Iterable[str] | None = None, enabled: bool = True
+) -> int:
+    """Toggle activation checkpointing of submodules which support it, i.e. having
+    attribute `checkpoint_segment`. Their activations are recomputed in backward
+    instead of stored, which saves memory at the cost of another forward
+
+    Args:
+        segments: Only toggle submodules of these segments, e.g. "backbone" or
+            "head". All segments if `None`
+
+    Returns:
+        Number of submodules toggled
+    """
+    segments = None if segments is None else set(segments)
+    count = 0
+    for module in model.modules():
+        segment = getattr(module, "checkpoint_segment", None)
+        if segment is None or (segments is not None and segment not in segments):
+            continue
+        module.activation_checkpointing = enabled
+        count += 1
+    return count
+
+
+def is_checkpointing(module: nn.Module) -> bool:
+    """Whether :param:`module` should run with :func:`checkpoint_forward` now"""
+    enabled = getattr(module, "activation_checkpointing", False)
+    return enabled and torch.is_grad_enabled()
+
+
+def checkpoint_forward(
+    module: nn.Module, *inputs: Any, forward: Callable[..., Any] | None = None
+) -> Any:
+    """Run `forward(*inputs)` with activation checkpointing. Running stats of
+    batch norms in :param:`module` are not updated again when recomputing
+
+    Args:
+        forward: Defaults to :param:`module` itself
+    """
+    return checkpoint(
+        forward or module,
+        *inputs,
+        use_reentrant=False,
+        context_fn=lambda: (nullcontext(), _frozen_norm_stats(module)),
+    )
+
+
+@contextmanager
+def _frozen_norm_stats(module: nn.Module):
+    norms = [m for m in module.modules() if isinstance(m, _BatchNorm)]
+    momenta = [m.momentum for m in norms]
+    tracked = [
+        None if m.num_batches_tracked is None else m.num_batches_tracked.clone()
+        for m in norms
+    ]
+    for m in norms:
+        m.momentum = 0.0  # running = (1 - 0) * running + 0 * batch
+    try:
+        yield
+    finally:
+        for m, momentum, num_tracked in zip(norms, momenta, tracked):
+            m.momentum = momentum
+            if num_tracked is not None and m.num_batches_tracked is not None:
+                m.num_batches_tracked.copy_(num_tracked)
@@ -3,6 +3,8 @@
 Since this use the FPN architecture, the implementation is very similar to UPerNet
 """
 
+from functools import partial
+
 import torch
 from torch import Tensor, nn
 from torch.hub import load_state_dict_from_url
@@ -17,7 +19,12 @@ from torchvision.models.resnet import (
 from ..datasets import CITYSCAPES_LABELS, VOC_LABELS
 from .backbones import ResNetBackbone
 from .model_registry import SegWeights, SegWeightsEnum, register_model
-from .model_utils import _generate_docstring, _validate_weights_input
+from .model_utils import (
+    _generate_docstring,
+    _validate_weights_input,
+    checkpoint_forward,
+    is_checkpointing,
+)
 from .pspnet import PyramidPoolingModule
 
 
@@ -106,6 +113,10 @@ class FlowAlignmentModule(nn.Module):
 
 
 class SFNetHead(nn.Module):
+    """Support activation checkpointing of each flow alignment stage"""
+
+    checkpoint_segment = "head"
+
     def __init__(
         self,
         out_channels: int,
@@ -139,6 +150,12 @@ class SFNetHead(nn.Module):
             ConvNormAct(len(feature_channels) * fpn_channels, fpn_channels, 3),
             nn.Conv2d(fpn_channels, out_channels, kernel_size=1),
         )
+        self.activation_checkpointing = False
+
+    def _align(self, key: str, feature: Tensor, layer_acc: Tensor) -> Tensor:
+        feature_out = self.fpn_ins[key](feature)
+        fam_out = self.fams[key](feature_out, layer_acc)
+        return feature_out + fam_out
 
     def forward(
         self, feature_maps: dict[str, Tensor]
@@ -148,10 +165,13 @@ class SFNetHead(nn.Module):
         layer_acc = last_feature  # accumulate layers
         reverse_fpn_keys = list(feature_maps.keys())[-2::-1]  # also skip last key
         for k in reverse_fpn_keys:
-            feature = feature_maps[k]
-            feature_out = self.fpn_ins[k](feature)
-            fam_out = self.fams[k](feature_out, layer_acc)
-            layer_acc = feature_out + fam_out
+            align = partial(self._align, k)
+            if is_checkpointing(self):
+                layer_acc = checkpoint_forward(
+                    self, feature_maps[k], layer_acc, forward=align
+                )
+            else:
+                layer_acc = align(feature_maps[k], layer_acc)
             layer_outs[k] = layer_acc
 
         fpn_features = [last_feature]
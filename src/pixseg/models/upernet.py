@@ -12,7 +12,12 @@ from torchvision.models.resnet import (
 from ..datasets import CITYSCAPES_LABELS, VOC_LABELS
 from .backbones import ResNetBackbone
 from .model_registry import SegWeights, SegWeightsEnum, register_model
-from .model_utils import _generate_docstring, _validate_weights_input
+from .model_utils import (
+    _generate_docstring,
+    _validate_weights_input,
+    checkpoint_forward,
+    is_checkpointing,
+)
 from .pspnet import PyramidPoolingModule
 
 
@@ -35,6 +40,10 @@ class ConvNormAct(nn.Sequential):
 
 
 class UperNetHead(nn.Module):
+    """Support activation checkpointing of the whole FPN"""
+
+    checkpoint_segment = "head"
+
     def __init__(
         self,
         out_channels: int,
@@ -55,8 +64,14 @@ class UperNetHead(nn.Module):
         self.final_conv = ConvNormAct(
             len(feature_channels) * fpn_channels, out_channels, 3
         )
+        self.activation_checkpointing = False
 
     def forward(self, feature_maps: dict[str, Tensor]) -> Tensor:
+        if is_checkpointing(self):
+            return checkpoint_forward(self, feature_maps, forward=self._forward)
+        return self._forward(feature_maps)
+
+    def _forward(self, feature_maps: dict[str, Tensor]) -> Tensor:
         last_key = list(feature_maps.keys())[-1]
         assert (
             feature_maps[last_key].size(1) == self.fpn_channels
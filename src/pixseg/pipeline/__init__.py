@@ -1,14 +1,39 @@
 """Combine components for the experiments and monitoring"""
 
 try:
+    from .checkpoint_writer import CheckpointWriter
+    from .compile import (
+        GRAPH_BREAKS,
+        compile_function,
+        compile_module,
+        explain_graph_breaks,
+        explain_model_zoo,
+    )
     from .config import Config
-    from .engine import create_snapshots, eval_one_epoch, forward_batch, train_one_epoch
+    from .distributed import (
+        ResumableDistributedSampler,
+        init_distributed,
+        launch,
+        unwrap_model,
+        wrap_model,
+    )
+    from .engine import (
+        SnapshotBatch,
+        create_snapshots,
+        eval_one_epoch,
+        forward_batch,
+        train_one_epoch,
+        upsample_argmax,
+    )
     from .logger import LocalLogger, TensorboardLogger, WandbLogger, init_logging
+    from .prefetch import Prefetcher
+    from .profiling import create_profiler
     from .test_time import (
         TestTimeAugmentations,
         inference_with_augmentations,
         inference_with_sliding_window,
     )
+    from .timing import StepTimer
     from .trainer import Checkpoint, Trainer
 except ModuleNotFoundError:
     raise ImportError(
@@ -0,0 +1,191 @@
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+from queue import Queue
+from typing import Any, Callable, Literal
+
+import torch
+from torch import Tensor
+
+from ..utils.tensor_file import SUFFIX, save_tensor_file
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = "model.pth"
+TENSOR_MODEL_FILE = "model" + SUFFIX
+CHECKPOINT_FILE = "checkpoint.pth"
+
+ModelFormat = Literal["torch", "tensors"]
+"""Format of model file. "tensors" is memory-mappable. See :func:`save_tensor_file`"""
+
+SavedCallback = Callable[[Path, Path], None]
+"""Called with the paths of model and checkpoint file when both are durable"""
+
+
+def copy_to_cpu(obj: Any) -> Any:
+    """Recursively copy the Tensors in nested dicts, lists and tuples to cpu. Other
+    values are kept as is"""
+    if isinstance(obj, Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: copy_to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(copy_to_cpu(v) for v in obj)
+    return obj
+
+
+def resolve_model_path(checkpoint_file: Path, model_path: str) -> Path:
+    """Resolve "model_path" of :class:`Checkpoint`, which is relative to the
+    checkpoint file itself"""
+    # normalize first since a file cannot be traversed on posix
+    return Path(os.path.normpath(checkpoint_file / model_path))
+
+
+class CheckpointWriter:
+    """Serialize checkpoints in a background thread
+
+    Each save is written once into the first folder. The other folders get hard
+    links of the same files, or copies if linking is not supported. Files are
+    written to temporary names, synced, and renamed, so a folder never contains
+    partial files. At most one save waits while another is being written
+
+    Example usage:
+    ```
+        writer = CheckpointWriter(callback=on_saved)
+        foreach epoch:
+            writer.save(model_state, checkpoint, [step_folder, latest_folder])
+        writer.close()
+    ```
+    """
+
+    def __init__(
+        self,
+        callback: SavedCallback | None = None,
+        background: bool = True,
+        model_format: ModelFormat = "torch",
+    ) -> None:
+        """
+        Args:
+            callback: Called in the writer thread after each folder is written
+            background: If `False`, write in the calling thread instead
+            model_format: Save model as :data:`MODEL_FILE` with :func:`torch.save`,
+                or :data:`TENSOR_MODEL_FILE` with :func:`save_tensor_file`
+        """
+        self.callback = callback
+        self.background = background
+        self.model_file = MODEL_FILE if model_format == "torch" else TENSOR_MODEL_FILE
+        self._queue: Queue[tuple | None] = Queue(maxsize=1)
+        self._error: BaseException | None = None
+        self._thread: threading.Thread | None = None
+
+    def save(
+        self,
+        model_state: dict[str, Tensor],
+        checkpoint: dict[str, Any],
+        folders: list[Path],
+        remove: list[Path] | None = None,
+    ):
+        """Copy states to cpu now, and write them into each folder as
+        :attr:`model_file` and :data:`CHECKPOINT_FILE`
+
+        Args:
+            checkpoint: Its "model_path" is set to the model file in the same folder
+            remove: Folders to delete after writing, e.g. by retention
+        """
+        self._raise_error()
+        model_state = copy_to_cpu(model_state)
+        checkpoint = copy_to_cpu(checkpoint)
+        checkpoint["model_path"] = str(Path("..") / self.model_file)
+        job = (model_state, checkpoint, folders, remove or [])
+        if not self.background:
+            self._write(*job)
+            return
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._queue.put(job)
+
+    def flush(self):
+        """Wait until all submitted saves are written"""
+        if self._thread is not None:
+            self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Flush and stop the writer thread"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Failed to write checkpoint") from error
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                if self._error is None:
+                    self._write(*job)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(
+        self,
+        model_state: dict[str, Tensor],
+        checkpoint: dict[str, Any],
+        folders: list[Path],
+        remove: list[Path],
+    ):
+        source: tuple[Path, Path] | None = None
+        for folder in folders:
+            folder.mkdir(parents=True, exist_ok=True)
+            model_file = folder / self.model_file
+            checkpoint_file = folder / CHECKPOINT_FILE
+            if source is None:
+                if model_file.suffix == SUFFIX:
+                    _atomic_save(model_state, model_file, save_tensor_file)
+                else:
+                    _atomic_save(model_state, model_file, torch.save)
+                _atomic_save(checkpoint, checkpoint_file, torch.save)
+                source = (model_file, checkpoint_file)
+            else:
+                _atomic_link(source[0], model_file)
+                _atomic_link(source[1], checkpoint_file)
+            if self.callback is not None:
+                self.callback(model_file, checkpoint_file)
+
+        for folder in remove:
+            shutil.rmtree(folder, ignore_errors=True)
+            logger.debug(f"Removed checkpoint {folder}")
+
+
+def _atomic_save(obj: Any, path: Path, save_fn: Callable[[Any, Path], None]):
+    temp_path = path.with_name(path.name + ".tmp")
+    save_fn(obj, temp_path)
+    with open(temp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def _atomic_link(source: Path, path: Path):
+    temp_path = path.with_name(path.name + ".tmp")
+    temp_path.unlink(missing_ok=True)
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        # e.g. file system without hard links
+        shutil.copyfile(source, temp_path)
+        with open(temp_path, "rb") as f:
+            os.fsync(f.fileno())
+    os.replace(temp_path, path)
@@ -0,0 +1,104 @@
+"""Integrate :func:`torch.compile` into the pipeline"""
+
+import logging
+from inspect import signature
+from typing import Callable, Iterable, Sequence, TypeVar
+
+import torch
+from torch import Tensor, nn
+
+from ..models import MODEL_ZOO
+from .distributed import unwrap_model
+
+logger = logging.getLogger(__name__)
+
+GRAPH_BREAKS: dict[str, list[str]] = {}
+"""Mapping of model name to reasons of graph breaks. See :func:`explain_graph_breaks`"""
+
+M = TypeVar("M", bound=nn.Module)
+F = TypeVar("F", bound=Callable)
+
+
+def _with_fallback(func: F, fallback: bool) -> F:
+    """Wrap compiled :param:`func` so dynamo only suppresses errors in its calls.
+    Frames are compiled lazily on call, so setting it around :func:`torch.compile`
+    has no effect"""
+    return torch._dynamo.config.patch(suppress_errors=fallback)(func)
+
+
+def compile_module(
+    module: M,
+    fallback: bool = True,
+    explain_inputs: Sequence[Tensor] | None = None,
+    **kwargs,
+) -> M:
+    """Compile the forward of :param:`module` in place, so its state dict keeps the
+    same keys
+
+    Args:
+        fallback: If `True`, frames that fail to compile run in eager mode instead of
+            raising errors. Other compiled functions are unaffected
+        explain_inputs: If provided, log graph breaks of :param:`module` on these
+            inputs in eval mode before compiling, under its class name. See
+            :func:`explain_graph_breaks`
+        kwargs: See :func:`torch.compile`
+    """
+    if explain_inputs is not None:
+        model = unwrap_model(module)
+        training = model.training
+        model.eval()
+        with torch.no_grad():
+            explain_graph_breaks(type(model).__name__, model, *explain_inputs)
+        model.train(training)
+    # hooks still run in eager mode around the compiled forward
+    module.forward = _with_fallback(torch.compile(module.forward, **kwargs), fallback)
+    return module
+
+
+def compile_function(func: F, fallback: bool = True, **kwargs) -> F:
+    """Same as :func:`compile_module` but for functions, e.g. :func:`forward_batch`"""
+    return _with_fallback(torch.compile(func, **kwargs), fallback)  # type: ignore
+
+
+def explain_graph_breaks(name: str, model: nn.Module, *inputs: Tensor) -> list[str]:
+    """Trace :param:`model` with :param:`inputs` and record the reasons of graph
+    breaks in :data:`GRAPH_BREAKS` under :param:`name`
+
+    If tracing fails, the error is recorded as the only reason
+    """
+    try:
+        explanation = torch._dynamo.explain(model)(*inputs)
+        reasons = [str(b.reason) for b in explanation.break_reasons]
+    except Exception as e:
+        reasons = [f"{type(e).__name__}: {e}"]
+    finally:
+        torch._dynamo.reset()
+
+    GRAPH_BREAKS[name] = reasons
+    logger.info(f"Found {len(reasons)} graph breaks in {name}")
+    for r in reasons:
+        logger.debug(f"Graph break in {name}: {r}")
+    return reasons
+
+
+def explain_model_zoo(
+    names: Iterable[str] | None = None, input_size: Sequence[int] = (2, 3, 256, 256)
+) -> dict[str, list[str]]:
+    """Run :func:`explain_graph_breaks` on models in :data:`MODEL_ZOO` in eval mode
+
+    Args:
+        names: Model names to explain. All models if `None`
+    """
+    names = MODEL_ZOO.keys() if names is None else names
+    results: dict[str, list[str]] = {}
+    for name in names:
+        builder = MODEL_ZOO[name]
+        # backbone weights are irrelevant
+        kwargs = {}
+        if "weights_backbone" in signature(builder).parameters:
+            kwargs["weights_backbone"] = None
+        model = builder(**kwargs)
+        model.eval()
+        with torch.no_grad():
+            results[name] = explain_graph_breaks(name, model, torch.rand(input_size))
+    return results
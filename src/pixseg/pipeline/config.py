@@ -11,12 +11,31 @@ from torch.nn.modules.loss import _Loss as Loss
 from torch.optim import Optimizer
 from torch.optim.lr_scheduler import LRScheduler
 from torch.utils import data
+from torchvision.models import get_model_weights
 from torchvision.transforms import v2
 
 from ..datasets import DATASET_ZOO, DatasetMeta, resolve_metadata
 from ..learn import CLASS_WEIGHTINGS, CRITERION_ZOO, LR_SCHEDULER_ZOO, OPTIMIZER_ZOO
-from ..models import MODEL_WEIGHTS, MODEL_ZOO
-from ..utils.transform import SegmentationAugment, SegmentationTransform
+from ..models import (
+    MODEL_WEIGHTS,
+    MODEL_ZOO,
+    build_from_state_dict,
+    set_activation_checkpointing,
+)
+from ..utils.tensor_file import load_state_file
+from ..utils.transform import (
+    BatchSegmentationAugment,
+    SegmentationAugment,
+    SegmentationTransform,
+)
+from .distributed import (
+    ResumableDistributedSampler,
+    get_rank,
+    get_world_size,
+    init_distributed,
+    is_main_process,
+    local_device,
+)
 from .logger import LocalLogger, Logger, TensorboardLogger, WandbLogger
 from .trainer import Trainer
 
@@ -54,23 +73,32 @@ class Config:
             self._out_folder = Path(runs_folder) / sub_folder
         return self._out_folder
 
+    @property
+    def distributed(self) -> bool:
+        return self.config["trainer"].get("distributed", False)
+
     @property
     def device(self) -> str:
+        """Device of this process. See :func:`local_device`"""
         device = self.config["trainer"]["device"]
-        if device != "auto":
-            return device
-        return "cuda" if torch.cuda.is_available() else "cpu"
+        if device == "auto":
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        if self.distributed:
+            device = local_device(device)
+        return device
 
     def build_model(self) -> nn.Module:
         model_name = self.config["model"]["model"]
         params: dict = self.config["model"]["params"].copy()
         weights = params.pop("weights", None)
+        checkpointing = params.pop("activation_checkpointing", False)
         num_classes = self.dataset_meta.num_classes
-        model = MODEL_ZOO[model_name](num_classes=num_classes, **params)
 
         # safely load model state dict
+        model: nn.Module | None = None
         state_dict = None
         state_file = self.config["model"].get("state_file")
+        state_prefixes = self.config["model"].get("state_prefixes", [])
         if weights is not None and state_file is not None:
             raise ValueError("Expect at most one of state_file or params.weights")
         # access weights state dict directly if possible
@@ -84,13 +112,36 @@ class Config:
                     seg_weights.url, progress=params.get("progress", True)
                 )
             else:
-                model_with_weights = MODEL_ZOO[model_name](weights=weights, **params)
-                state_dict = model_with_weights.state_dict()
+                # torchvision weights can only be loaded by the builder
+                builder = MODEL_ZOO[model_name]
+                tv_weights = get_model_weights(builder).verify(weights)
+                model = builder(weights=weights, **params)
+                if len(tv_weights.meta["categories"]) != num_classes:
+                    state_dict = model.state_dict()
+                    model = None
         if state_file is not None:
-            state_dict = torch.load(state_file)
+            state_dict = load_state_file(state_file, state_prefixes)
 
-        if state_dict is not None:
-            safe_transfer_state_dict(model, state_dict)
+        if model is None and state_dict is not None:
+            # skip initialization if all weights are available
+            model = build_from_state_dict(
+                MODEL_ZOO[model_name], state_dict, num_classes=num_classes, **params
+            )
+            if model is not None:
+                logger.info("All weights are assigned to model built on meta device")
+        if model is None:
+            model = MODEL_ZOO[model_name](num_classes=num_classes, **params)
+            if state_dict is not None:
+                safe_transfer_state_dict(model, state_dict)
+
+        if checkpointing:
+            segments = None if checkpointing is True else checkpointing
+            count = set_activation_checkpointing(model, segments)
+            if count == 0:
+                warnings.warn(
+                    f"activation_checkpointing is set but {model_name} does not"
+                    f" support it for segments {segments}. This has no effect."
+                )
         return model
 
     def build_datasets(self) -> tuple[data.Dataset, data.Dataset]:
@@ -111,17 +162,47 @@ class Config:
         self, train_dataset: data.Dataset, val_dataset: data.Dataset
     ) -> tuple[data.DataLoader, data.DataLoader]:
         num_workers = self.config["data"]["loader"]["num_workers"]
-        train_params = self.config["data"]["loader"]["params"]
+        train_params = self.config["data"]["loader"]["params"].copy()
+        train_sampler = val_sampler = None
+        trainer_params = self.config["trainer"]["params"]
+        # checkpoints may be saved in the middle of epochs
+        resumable = any(
+            trainer_params.get(k) is not None
+            for k in ("checkpoint_every_n_steps", "max_steps")
+        )
+        if self.distributed or resumable:
+            # shuffling is done by sampler instead
+            shuffle = train_params.pop("shuffle", False)
+            drop_last = train_params.get("drop_last", False)
+            train_sampler = ResumableDistributedSampler(
+                train_dataset,  # type: ignore
+                get_world_size(),
+                get_rank(),
+                shuffle=shuffle,
+                drop_last=drop_last,
+            )
+        if self.distributed:
+            val_sampler = ResumableDistributedSampler(
+                val_dataset, shuffle=False  # type: ignore
+            )
         train_loader = data.DataLoader(
-            train_dataset, num_workers=num_workers, **train_params
+            train_dataset,
+            num_workers=num_workers,
+            sampler=train_sampler,
+            **train_params,
+        )
+        val_loader = data.DataLoader(
+            val_dataset, num_workers=num_workers, sampler=val_sampler
         )
-        val_loader = data.DataLoader(val_dataset, num_workers=num_workers)
         return train_loader, val_loader
 
     def build_data_augments(self) -> tuple[v2.Transform, v2.Transform]:
         ignore_index = self.dataset_meta.ignore_index
         train_params = self.config["data"]["augment"]["params"]
-        train_augment = SegmentationAugment(**train_params, mask_fill=ignore_index)
+        augment_cls = SegmentationAugment
+        if self.config["data"]["augment"].get("batched", False):
+            augment_cls = BatchSegmentationAugment
+        train_augment = augment_cls(**train_params, mask_fill=ignore_index)
         val_augment = SegmentationAugment(mask_fill=ignore_index)
         return train_augment, val_augment
 
@@ -158,6 +239,7 @@ class Config:
         params = self.config["trainer"]["params"]
         params["out_folder"] = self.out_folder
         params["device"] = self.device
+        params["distributed"] = self.distributed
 
         aux_weight = self.config["criterion"]["aux_weight"]
         has_aux_loss = self.config["model"]["params"].get("aux_loss", False)
@@ -167,8 +249,14 @@ class Config:
                 " This may not have any effect."
             )
         params["loss_weight"] = {"aux": aux_weight}
+        params["loss_stride"] = self.config["criterion"].get("loss_stride")
+        params["mask_downsample"] = self.config["criterion"].get(
+            "mask_downsample", "nearest"
+        )
 
         batch_size = self.config["data"]["loader"]["params"].get("batch_size", 1)
+        # batches of all processes are optimized together
+        batch_size *= get_world_size()
         effective_batch_size = self.config["optimizer"]["effective_batch_size"]
         if effective_batch_size % batch_size != 0:
             raise ValueError(
@@ -180,6 +268,8 @@ class Config:
         return params
 
     def build_loggers(self) -> list[Logger]:
+        if not is_main_process():
+            return []
         loggers: list[Logger] = [LocalLogger(self.out_folder, self.dataset_meta.labels)]
         config_to_log = {k: v for k, v in self.config.items() if k != "log"}
         config_dict = _flatten_nested_dict(config_to_log)
@@ -205,6 +295,8 @@ class Config:
         return loggers
 
     def to_trainer(self) -> Trainer:
+        if self.distributed:
+            init_distributed(self.device)
         model = self.build_model()
         train_dataset, val_dataset = self.build_datasets()
         train_loader, val_loader = self.build_data_loaders(train_dataset, val_dataset)
@@ -274,8 +366,10 @@ def safe_transfer_state_dict(model: nn.Module, state_dict: dict[str, Tensor]):
     logger.info("Transferring weights to model ...")
     filtered_state_dict = {}
     mismatch_keys = []
+    model_state_dict = model.state_dict()
+    # shapes of memory-mapped tensors are read from header without touching data
     for k, v in state_dict.items():
-        model_v = model.state_dict().get(k, None)
+        model_v = model_state_dict.get(k, None)
         if isinstance(model_v, Tensor) and model_v.shape != v.shape:
             mismatch_keys.append(k)
         else:
@@ -0,0 +1,184 @@
+"""Run the pipeline in multiple processes with :module:`torch.distributed`
+
+Example usage with torchrun:
+```
+    # torchrun --nproc-per-node 4 train.py
+    init_distributed("cpu")
+    trainer = Trainer(*params, distributed=True)
+    trainer.train()
+```
+Or spawn the processes on this node with :func:`launch`
+"""
+
+import logging
+import os
+from typing import Any, Callable, Iterator, Sized
+
+import torch
+from torch import distributed as dist
+from torch import multiprocessing as mp
+from torch import nn
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils import data
+
+logger = logging.getLogger(__name__)
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    """Global rank of this process. `0` if not distributed"""
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    """Number of processes. `1` if not distributed"""
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process() -> bool:
+    """Whether this process should log and save files"""
+    return get_rank() == 0
+
+
+def local_device(device: str) -> str:
+    """Return the device of this process, i.e. `cuda:{LOCAL_RANK}` if
+    :param:`device` is cuda. Other devices are shared by all processes
+    """
+    if device != "cuda" or "LOCAL_RANK" not in os.environ:
+        return device
+    return f"cuda:{os.environ['LOCAL_RANK']}"
+
+
+def init_distributed(device: str, backend: str | None = None):
+    """Initialize the default process group from the environment variables set by
+    torchrun or :func:`launch`. Do nothing if already initialized
+
+    Logs below warning are disabled in processes other than the main one
+
+    Args:
+        device: Device of this process. See :func:`local_device`
+        backend: Use "nccl" for cuda and "gloo" otherwise if `None`
+    """
+    if is_distributed():
+        return
+    device_type = torch.device(device).type
+    if device_type == "cuda":
+        torch.cuda.set_device(torch.device(local_device(device)))
+    if backend is None:
+        backend = "nccl" if device_type == "cuda" else "gloo"
+    dist.init_process_group(backend)
+    if not is_main_process():
+        logging.disable(logging.INFO)
+    logger.info(f"Initialized {backend} process group of {get_world_size()} processes")
+
+
+def launch(
+    fn: Callable[..., Any],
+    nprocs: int,
+    *args,
+    master_addr: str = "127.0.0.1",
+    master_port: int = 29500,
+):
+    """Spawn :param:`nprocs` processes on this node to run `fn(*args)`, with the same
+    environment variables as torchrun. :param:`fn` should call :func:`init_distributed`
+    and must be picklable. The process group is destroyed when :param:`fn` returns
+    """
+    mp.spawn(
+        _run_worker,
+        args=(fn, nprocs, master_addr, master_port, args),
+        nprocs=nprocs,
+    )
+
+
+def _run_worker(
+    rank: int,
+    fn: Callable[..., Any],
+    world_size: int,
+    master_addr: str,
+    master_port: int,
+    args: tuple,
+):
+    os.environ["RANK"] = os.environ["LOCAL_RANK"] = str(rank)
+    os.environ["WORLD_SIZE"] = os.environ["LOCAL_WORLD_SIZE"] = str(world_size)
+    os.environ["MASTER_ADDR"] = master_addr
+    os.environ["MASTER_PORT"] = str(master_port)
+    try:
+        fn(*args)
+    finally:
+        if is_distributed():
+            dist.destroy_process_group()
+
+
+def wrap_model(
+    model: nn.Module, device: str, sync_batch_norm: bool = True, **kwargs
+) -> DistributedDataParallel:
+    """Wrap :param:`model` for data-parallel training. Parameters are kept, so
+    existing optimizers still apply
+
+    Args:
+        sync_batch_norm: Convert batch norms to :class:`nn.SyncBatchNorm`. Only
+            applied on cuda, since it is not supported on cpu
+        kwargs: See :class:`DistributedDataParallel`
+    """
+    device_type = torch.device(device).type
+    if sync_batch_norm and device_type == "cuda":
+        model = nn.SyncBatchNorm.convert_sync_batchnorm(model)
+    elif sync_batch_norm:
+        logger.info(f"SyncBatchNorm is not supported on {device_type}. Skipped")
+    device_ids = [torch.device(device)] if device_type == "cuda" else None
+    kwargs.setdefault("gradient_as_bucket_view", True)
+    return DistributedDataParallel(model, device_ids=device_ids, **kwargs)
+
+
+def unwrap_model(model: nn.Module) -> nn.Module:
+    """Return the underlying model of :class:`DistributedDataParallel`, so the keys
+    of state dict are the same as in single process"""
+    if isinstance(model, DistributedDataParallel):
+        return model.module
+    return model
+
+
+class ResumableDistributedSampler(data.DistributedSampler):
+    """Same as :class:`DistributedSampler` but can start from the middle of an epoch
+
+    The order of each epoch is determined by seed and epoch, so skipping the
+    consumed samples continues exactly where it stopped
+    """
+
+    def __init__(
+        self,
+        dataset: Sized,
+        num_replicas: int | None = None,
+        rank: int | None = None,
+        shuffle: bool = True,
+        seed: int = 0,
+        drop_last: bool = False,
+    ) -> None:
+        super().__init__(
+            dataset, num_replicas, rank, shuffle, seed, drop_last  # type: ignore
+        )
+        self.start_index = 0
+
+    def set_epoch(self, epoch: int, start_index: int = 0) -> None:
+        """
+        Args:
+            start_index: Number of samples of this replica to skip in this epoch
+        """
+        super().set_epoch(epoch)
+        self.start_index = start_index
+
+    def __iter__(self) -> Iterator[int]:
+        indices = list(super().__iter__())
+        return iter(indices[self.start_index :])
+
+    def __len__(self) -> int:
+        return self.num_samples - self.start_index
+
+    def state_dict(self) -> dict[str, int]:
+        return {"epoch": self.epoch, "start_index": self.start_index}
+
+    def load_state_dict(self, state_dict: dict[str, int]):
+        self.set_epoch(state_dict["epoch"], state_dict["start_index"])
@@ -1,52 +1,304 @@
+import math
 import random
+from contextlib import nullcontext
 from timeit import default_timer
-from typing import Sequence
+from typing import Callable, Literal, Sequence
 
 import torch
 import tqdm
 from torch import GradScaler, Tensor, nn
 from torch.nn import functional as F
+from torch.nn.parallel import DistributedDataParallel
 from torch.optim import Optimizer
+from torch.optim.lr_scheduler import LRScheduler
+from torch.profiler import profile
 from torch.utils import data
 from torchvision.transforms import v2
 
-from ..utils.metrics import MetricStore
-from ..utils.visual import draw_mask_on_image
+from ..utils.metrics import BoundaryStore, CalibrationStore, MetricStore
+from ..utils.rng import load_rng_state_dict
+from ..utils.transform import downsample_mask
+from ..utils.visual import overlay_masks
+from .prefetch import Prefetcher
+from .timing import StepTimer, split_times, timed
+
+ForwardFn = Callable[..., tuple[dict[str, Tensor], dict[str, Tensor], Tensor]]
+"""Signature of :func:`forward_batch` with `return_masks=True`"""
+
+Precision = Literal["fp32", "bf16", "fp16"]
+PRECISION_DTYPES: dict[str, torch.dtype | None] = {
+    "fp32": None,
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16,
+}
+
+
+def autocast(device: str, precision: Precision | None = None) -> torch.autocast:
+    """Return autocast context of :param:`precision` on :param:`device`
+
+    If :param:`precision` is `None`, autocast with the default dtype except on cpu
+    """
+    device_type = torch.device(device).type
+    if precision is None:
+        return torch.autocast(device_type, enabled=device_type != "cpu")
+    if precision not in PRECISION_DTYPES:
+        raise ValueError(
+            f"Unknown precision {precision}. Expect one of {list(PRECISION_DTYPES)}"
+        )
+    dtype = PRECISION_DTYPES[precision]
+    return torch.autocast(device_type, dtype=dtype, enabled=dtype is not None)
+
+
+def needs_grad_scaler(device: str, precision: Precision | None = None) -> bool:
+    """Whether gradients should be scaled, i.e. autocast to float16. See
+    :func:`autocast`"""
+    if precision is None:
+        return torch.device(device).type != "cpu"
+    return precision == "fp16"
+
+
+class ProgressReporter:
+    """Show metrics on progress bar while throttling the calls to
+    :meth:`MetricStore.summarize`
+
+    The last summary is cached and only recomputed when either interval has passed
+    """
+
+    def __init__(
+        self,
+        loader: tqdm.tqdm,
+        ms: MetricStore,
+        refresh_seconds: float | None = 1.0,
+        refresh_steps: int | None = None,
+    ) -> None:
+        """
+        Args:
+            refresh_seconds: Minimum time between refreshes. Ignored if `None`
+            refresh_steps: Number of steps between refreshes. Ignored if `None`
+        """
+        self.loader = loader
+        self.ms = ms
+        self.refresh_seconds = refresh_seconds
+        self.refresh_steps = refresh_steps
+        self.summary: dict[str, float] = {}
+        self._last_time = default_timer()
+        self._last_step = 0
+        self._step = 0
+
+    def step(self):
+        """Call once after each batch is stored"""
+        self._step += 1
+        if self.loader.disable:
+            return
+        due_by_time = (
+            self.refresh_seconds is not None
+            and default_timer() - self._last_time >= self.refresh_seconds
+        )
+        due_by_step = (
+            self.refresh_steps is not None
+            and self._step - self._last_step >= self.refresh_steps
+        )
+        if due_by_time or due_by_step:
+            self.refresh()
+
+    def refresh(self):
+        """Recompute the summary and show it immediately"""
+        self._last_time = default_timer()
+        self._last_step = self._step
+        if self.loader.disable or self._step == 0:
+            return
+        # time breakdown is too long to show
+        self.summary, _ = split_times(self.ms.summarize())
+        self.loader.set_postfix(self.summary)
 
 
 def forward_batch(
     model: nn.Module,
     images: Tensor,
     masks: Tensor | None,
-    augment: v2.Transform,
+    augment: v2.Transform | None,
     criterion: nn.Module | None,
     device: str,
+    loss_stride: dict[str, int] | None = None,
+    mask_downsample: Literal["nearest", "majority"] = "nearest",
+    upsample: bool | Sequence[str] = True,
+    loss_budget: int | None = None,
+    pad_to_multiple: int | None = None,
+    channels_last: bool = False,
+    precision: Precision | None = None,
+    timer: StepTimer | None = None,
+    return_masks: bool = False,
     **kwargs,
 ):
-    """Return a tuple of (logits, losses)
+    """Return a tuple of (logits, losses), and masks if :param:`return_masks`
 
-    losses will be default if criterion is `None`
+    losses will be default if criterion is `None`. Skip augmentation if
+    :param:`augment` is `None`, e.g. when it is done by :class:`Prefetcher`
 
     :param:`model` and :param:`criterion` are assumed to be on :param:`device`
+
+    Args:
+        loss_stride: Output stride relative to mask size to compute the loss of each
+            logits key. Masks are downsampled instead of upsampling the logits, which
+            saves memory of the criterion. Missing keys use full resolution
+        mask_downsample: Method to downsample masks. See :func:`downsample_mask`
+        upsample: Keys of logits to return in mask size, or all keys if `True`.
+            Others are returned in the output size of model. Upsampled logits of
+            keys in :param:`loss_stride` have no gradients. Use
+            :func:`upsample_argmax` to get predictions with bounded memory
+        loss_budget: Maximum number of elements of resized logits to compute the loss
+            of keys not upsampled. If exceeded, the loss stride is increased until
+            they fit, so the loss is approximate. Unbounded if `None`
+        pad_to_multiple: Pad images at bottom and right to multiple of this size before
+            running the model, and crop the outputs back. Input shapes are then
+            bucketed, which avoids recompiling for each size when compiled
+        channels_last: Feed images in channels last memory format. The model should
+            be converted as well
+        precision: Autocast precision. See :func:`autocast`
+        timer: Record time of phases "h2d", "augment", "forward" and "loss"
+        return_masks: Also return the masks on :param:`device` after augmentation,
+            so metrics are stored without another transfer
     """
-    images = images.to(device)
-    if masks is None:
-        masks = torch.zeros_like(images, dtype=torch.long)
-    masks = masks.to(device)
-    images, masks = augment(images, masks)
-
-    with torch.autocast(device_type=device, enabled=device != "cpu"):
-        logits: dict[str, Tensor] = model(images)
-        mask_size = masks.shape[-2:]  # type: ignore
-        for k, v in logits.items():
-            logits[k] = F.interpolate(v, mask_size, mode="bilinear")
-
-        losses: dict[str, Tensor] = {}
-        if criterion is not None:
-            losses = {k: criterion(v, masks) for k, v in logits.items()}
+    with timed(timer, "h2d"):
+        images = images.to(device)
+        if masks is None:
+            masks = torch.zeros_like(images, dtype=torch.long)
+        masks = masks.to(device)
+        if channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+    if augment is not None:
+        with timed(timer, "augment"):
+            images, masks = augment(images, masks)
+
+    loss_stride = loss_stride or {}
+    image_size = images.shape[-2:]
+    if pad_to_multiple is not None:
+        pad_h = -image_size[0] % pad_to_multiple
+        pad_w = -image_size[1] % pad_to_multiple
+        images = F.pad(images, [0, pad_w, 0, pad_h])
+        if channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+
+    with autocast(device, precision):
+        with timed(timer, "forward"):
+            logits: dict[str, Tensor] = model(images)
+            if images.shape[-2:] != image_size:
+                for k, v in logits.items():
+                    out_h = round(v.size(-2) * image_size[0] / images.size(-2))
+                    out_w = round(v.size(-1) * image_size[1] / images.size(-1))
+                    logits[k] = v[..., :out_h, :out_w]
+        with timed(timer, "loss"):
+            mask_size = masks.shape[-2:]  # type: ignore
+            losses: dict[str, Tensor] = {}
+            small_masks: dict[int, Tensor] = {}  # cache for each stride
+            upsample_keys = set(logits) if upsample is True else set(upsample or ())
+            for k, v in logits.items():
+                stride = loss_stride.get(k, 1)
+                upsample_k = k in upsample_keys
+                if loss_budget is not None and not upsample_k:
+                    num_channels = v.size(0) * v.size(1)
+                    min_stride = _budget_stride(mask_size, num_channels, loss_budget)
+                    stride = max(stride, min_stride)
+                if stride == 1:
+                    if upsample_k or criterion is not None:
+                        full_logits = F.interpolate(v, mask_size, mode="bilinear")
+                        if criterion is not None:
+                            losses[k] = criterion(full_logits, masks)
+                        if upsample_k:
+                            logits[k] = full_logits
+                    continue
+
+                if criterion is not None:
+                    if stride not in small_masks:
+                        small_masks[stride] = downsample_mask(
+                            masks, stride, mask_downsample
+                        )
+                    small_size = small_masks[stride].shape[-2:]
+                    small_logits = F.interpolate(v, small_size, mode="bilinear")
+                    losses[k] = criterion(small_logits, small_masks[stride])
+                if upsample_k:
+                    with torch.no_grad():
+                        logits[k] = F.interpolate(v, mask_size, mode="bilinear")
+    if return_masks:
+        return logits, losses, masks
     return logits, losses
 
 
+def _budget_stride(size: Sequence[int], num_channels: int, max_elements: int) -> int:
+    """Return the smallest stride that downsamples :param:`size` to fit
+    :param:`max_elements` with :param:`num_channels`, or to 1 pixel at least"""
+    H, W = size
+    # lower bound since ceil(H / stride) * ceil(W / stride) >= H * W / stride^2
+    stride = math.isqrt(num_channels * H * W // max(1, max_elements))
+    stride = min(max(1, stride), max(H, W))
+    while num_channels * -(-H // stride) * -(-W // stride) > max_elements:
+        if stride >= max(H, W):
+            break
+        stride += 1
+    return stride
+
+
+@torch.no_grad()
+def upsample_argmax(
+    logits: Tensor,
+    size: Sequence[int],
+    max_elements: int | None = None,
+    return_prob: bool = False,
+) -> tuple[Tensor, Tensor | None]:
+    """Bilinearly upsample logits and take argmax of classes, while bounding the
+    size of upsampled float Tensor
+
+    If the full upsampled logits are larger than :param:`max_elements`, each sample
+    is upsampled in chunks of classes with running max. This gives the same results
+    since interpolation is independent in each class.
+
+    Args:
+        logits: float Tensor (B, C, h, w)
+        size: Output size (H, W)
+        max_elements: Maximum number of elements of upsampled logits at once. At least
+            one class of one sample is processed at a time. Unbounded if `None`
+        return_prob: Also return the max-softmax probability of each pixel
+
+    Returns:
+        A tuple of predictions (int Tensor (B, H, W)) and probabilities (float
+            Tensor (B, H, W)) if :param:`return_prob`, else `None`
+    """
+    B, C = logits.shape[:2]
+    num_pixels = size[0] * size[1]
+    groups, chunk_size = [logits], C
+    if max_elements is not None and B * C * num_pixels > max_elements:
+        groups, chunk_size = list(logits.split(1)), max(1, max_elements // num_pixels)
+
+    all_preds: list[Tensor] = []
+    all_probs: list[Tensor] = []
+    for group in groups:
+        best_values = best_indices = log_sum = torch.empty(0)
+        for start in range(0, C, chunk_size):
+            chunk = group[:, start : start + chunk_size]
+            upsampled = F.interpolate(chunk, list(size), mode="bilinear").float()
+            values, indices = upsampled.max(1)
+            indices += start
+            if start == 0:
+                best_values, best_indices = values, indices
+            else:
+                # strictly greater to keep the first max, same as argmax
+                better = values > best_values
+                best_values = torch.where(better, values, best_values)
+                best_indices = torch.where(better, indices, best_indices)
+            if return_prob:
+                chunk_log_sum = upsampled.logsumexp(1)
+                if start == 0:
+                    log_sum = chunk_log_sum
+                else:
+                    log_sum = torch.logaddexp(log_sum, chunk_log_sum)
+        all_preds.append(best_indices)
+        if return_prob:
+            all_probs.append((best_values - log_sum).exp())
+
+    probs = torch.cat(all_probs) if return_prob else None
+    return torch.cat(all_preds), probs
+
+
 def train_one_epoch(
     model: nn.Module,
     data_loader: data.DataLoader,
@@ -60,11 +312,29 @@ def train_one_epoch(
     loss_weight: dict[str, float],
     desc="Train",
     silent=False,
+    progress_seconds: float | None = 1.0,
+    progress_steps: int | None = None,
+    prefetch: bool = False,
+    loss_stride: dict[str, int] | None = None,
+    mask_downsample: Literal["nearest", "majority"] = "nearest",
+    pad_to_multiple: int | None = None,
+    channels_last: bool = False,
+    precision: Precision | None = None,
+    forward_fn: ForwardFn | None = None,
+    timer: StepTimer | None = None,
+    profiler: profile | None = None,
+    start_iteration: int = 0,
+    metric_store: MetricStore | None = None,
+    rng_state: dict | None = None,
+    step_callback: Callable[[int, MetricStore], bool | None] | None = None,
+    iteration_lr_scheduler: LRScheduler | None = None,
     **kwargs,
 ) -> MetricStore:
     """Train the given model for one epoch
 
-    :param:`model` and :param:`criterion` are assumed to be on :param:`device`
+    :param:`model` and :param:`criterion` are assumed to be on :param:`device`. If
+    :param:`model` is :class:`DistributedDataParallel`, gradients are only synced
+    in the iterations that update the weights
 
     Args:
         learn_step: Number of iterations before back propagating.
@@ -72,36 +342,113 @@ def train_one_epoch(
             Set to `0` for full batch learning. If batch size in :param:`dataloader` is `1`,
             this is the same as effective batch size.
         loss_weight: Weight for each named loss. Mainly used for "out" and "aux"
+        progress_seconds, progress_steps: Interval to refresh metrics on progress bar.
+            See :class:`ProgressReporter`
+        prefetch: Move and augment the next batch while computing the current one.
+            See :class:`Prefetcher`
+        loss_stride, mask_downsample: Resolution to compute the losses. See
+            :func:`forward_batch`
+        pad_to_multiple, channels_last, precision: See :func:`forward_batch`
+        forward_fn: Replacement of :func:`forward_batch`, e.g. compiled version
+        timer: Record time of each phase in :attr:`MetricStore.measures`, i.e. "data",
+            "backward", "step", "metric", "logging" and those in :func:`forward_batch`.
+            Moving and augmenting prefetched batches are counted in "data"
+        profiler: Started profiler to call `step()` after each step. See
+            :func:`create_profiler`
+        start_iteration: Number of iterations done before in this epoch, when
+            resuming. :param:`data_loader` should skip the data of them
+        metric_store: Store to continue accumulating in, when resuming
+        rng_state: Restored after the data iterator is created, when resuming. See
+            :func:`rng_state_dict`
+        step_callback: Called with the number of iterations done and the store
+            after each weight update except the last, e.g. to save checkpoints.
+            Stop the epoch if it returns `True`
+        iteration_lr_scheduler: Step after each weight update, for schedules by
+            iterations instead of epochs
     """
     model.train()
-    ms = MetricStore(num_classes)
+    ms = metric_store or MetricStore(num_classes, device)
+    batches, batch_augment = data_loader, augment
+    if prefetch:
+        prefetcher = Prefetcher(
+            data_loader, device, augment, channels_last=channels_last
+        )
+        batches, batch_augment = prefetcher, None
+    # the iterator of data loader draws from the global random state
+    batch_iter = iter(batches)
+    if rng_state is not None:
+        load_rng_state_dict(rng_state)
+    num_iterations = start_iteration + len(data_loader)
     loader = tqdm.tqdm(
-        enumerate(data_loader), total=len(data_loader), desc=desc, disable=silent
+        enumerate(batch_iter, start_iteration),
+        total=num_iterations,
+        initial=start_iteration,
+        desc=desc,
+        disable=silent,
     )
+    progress = ProgressReporter(loader, ms, progress_seconds, progress_steps)
+    data_start_time = default_timer()
     for i, (images, masks) in loader:
         start_time = default_timer()
-        logits, losses = forward_batch(model, images, masks, augment, criterion, device)
-        loss_sum = sum(v * loss_weight.get(k, 1) for k, v in losses.items())
-
-        if isinstance(loss_sum, Tensor):
-            scaler.scale(loss_sum).backward()
-        if (i + 1) % learn_step == 0 or i == len(loader) - 1:
-            scaler.step(optimizer)
-            scaler.update()
-            optimizer.zero_grad()
+        if timer is not None:
+            timer.add("data", start_time - data_start_time)
+        is_learn_step = (i + 1) % learn_step == 0 or i == num_iterations - 1
+        # only all-reduce gradients in the step that updates weights
+        sync_context = nullcontext()
+        if isinstance(model, DistributedDataParallel) and not is_learn_step:
+            sync_context = model.no_sync()
+        with sync_context:
+            logits, losses, masks = (forward_fn or forward_batch)(
+                model,
+                images,
+                masks,
+                batch_augment,
+                criterion,
+                device,
+                loss_stride=loss_stride,
+                mask_downsample=mask_downsample,
+                pad_to_multiple=pad_to_multiple,
+                channels_last=channels_last,
+                upsample=["out"],  # only needed for metrics
+                precision=precision,
+                timer=timer,
+                return_masks=True,
+            )
+            loss_sum = sum(v * loss_weight.get(k, 1) for k, v in losses.items())
+            if isinstance(loss_sum, Tensor):
+                with timed(timer, "backward"):
+                    scaler.scale(loss_sum).backward()
+
+        if is_learn_step:
+            with timed(timer, "step"):
+                scaler.step(optimizer)
+                scaler.update()
+                optimizer.zero_grad()
+                if iteration_lr_scheduler is not None:
+                    iteration_lr_scheduler.step()
         end_time = default_timer()
 
-        preds = logits["out"].argmax(1)
-        ms.store_results(masks, preds)
-        batch_size = images.size(0)
-        measures = {
-            "loss": losses["out"].item() * batch_size,
-            "time": end_time - start_time,
-        }
-        ms.store_measures(batch_size, measures)
-        if not silent:
-            loader.set_postfix(ms.summarize())
+        with timed(timer, "metric"):
+            preds = logits["out"].argmax(1)
+            ms.store_results(masks, preds)
+            batch_size = images.size(0)
+            measures = {
+                "loss": losses["out"].item() * batch_size,
+                "time": end_time - start_time,
+            }
+            ms.store_measures(batch_size, measures)
+        with timed(timer, "logging"):
+            progress.step()
+        if timer is not None:
+            ms.store_measures(0, timer.pop_times())
+        if profiler is not None:
+            profiler.step()
+        if step_callback is not None and is_learn_step and i < num_iterations - 1:
+            if step_callback(i + 1, ms):
+                break
+        data_start_time = default_timer()
 
+    progress.refresh()
     return ms
 
 
@@ -115,36 +462,142 @@ def eval_one_epoch(
     num_classes: int,
     desc="Eval",
     silent=False,
+    progress_seconds: float | None = 1.0,
+    progress_steps: int | None = None,
+    prefetch: bool = False,
+    loss_stride: dict[str, int] | None = None,
+    mask_downsample: Literal["nearest", "majority"] = "nearest",
+    pad_to_multiple: int | None = None,
+    channels_last: bool = False,
+    precision: Precision | None = None,
+    forward_fn: ForwardFn | None = None,
+    calibration: CalibrationStore | None = None,
+    boundary: BoundaryStore | None = None,
+    upsample_budget: int | None = None,
+    per_image: bool = False,
+    worst_k: int = 0,
+    timer: StepTimer | None = None,
+    profiler: profile | None = None,
     **kwargs,
 ) -> MetricStore:
     """Evaluate the given model for one epoch
 
     :param:`model` and :param:`criterion` are assumed to be on :param:`device`
+
+    See :func:`train_one_epoch` for the progress, prefetch, loss, forward, timer and
+    profiler arguments
+
+    Args:
+        calibration: If provided, also store the logits in it in the same pass
+        boundary: If provided, also store the predictions in it in the same pass
+        upsample_budget: Maximum number of elements of upsampled logits to compute
+            predictions at once. See :func:`upsample_argmax`. The loss is then
+            computed at a stride within the same budget. See :func:`forward_batch`
+        per_image, worst_k: Keep results of each image and track the worst ones. See
+            :class:`MetricStore`
     """
     model.eval()
-    ms = MetricStore(num_classes)
-    loader = tqdm.tqdm(
-        iter(data_loader), total=len(data_loader), desc=desc, disable=silent
-    )
+    ms = MetricStore(num_classes, device, per_image, worst_k)
+    batches, batch_augment = data_loader, augment
+    if prefetch:
+        prefetcher = Prefetcher(
+            data_loader, device, augment, channels_last=channels_last
+        )
+        batches, batch_augment = prefetcher, None
+    loader = tqdm.tqdm(iter(batches), total=len(data_loader), desc=desc, disable=silent)
+    progress = ProgressReporter(loader, ms, progress_seconds, progress_steps)
+    data_start_time = default_timer()
     for images, masks in loader:
         start_time = default_timer()
-        logits, losses = forward_batch(model, images, masks, augment, criterion, device)
+        if timer is not None:
+            timer.add("data", start_time - data_start_time)
+        logits, losses, masks = (forward_fn or forward_batch)(
+            model,
+            images,
+            masks,
+            batch_augment,
+            criterion,
+            device,
+            loss_stride=loss_stride,
+            mask_downsample=mask_downsample,
+            upsample=["out"] if upsample_budget is None else False,
+            loss_budget=upsample_budget,
+            pad_to_multiple=pad_to_multiple,
+            channels_last=channels_last,
+            precision=precision,
+            timer=timer,
+            return_masks=True,
+        )
         end_time = default_timer()
 
-        preds = logits["out"].argmax(1)
-        ms.store_results(masks, preds)
-        batch_size = images.size(0)
-        measures = {
-            "loss": losses["out"].item() * batch_size,
-            "time": end_time - start_time,
-        }
-        ms.store_measures(batch_size, measures)
-        if not silent:
-            loader.set_postfix(ms.summarize())
+        with timed(timer, "metric"):
+            if upsample_budget is None:
+                preds = logits["out"].argmax(1)
+                if calibration is not None:
+                    calibration.store_logits(masks, logits["out"])
+            else:
+                preds, probs = upsample_argmax(
+                    logits["out"],
+                    masks.shape[-2:],
+                    upsample_budget,
+                    return_prob=calibration is not None,
+                )
+                if calibration is not None and probs is not None:
+                    calibration.store_confidences(masks, preds, probs)
+            ms.store_results(masks, preds)
+            if boundary is not None:
+                boundary.store_results(masks, preds)
+            batch_size = images.size(0)
+            measures = {
+                "loss": losses["out"].item() * batch_size,
+                "time": end_time - start_time,
+            }
+            ms.store_measures(batch_size, measures)
+        with timed(timer, "logging"):
+            progress.step()
+        if timer is not None:
+            ms.store_measures(0, timer.pop_times())
+        if profiler is not None:
+            profiler.step()
+        data_start_time = default_timer()
 
+    progress.refresh()
     return ms
 
 
+class SnapshotBatch:
+    """Fixed items of a dataset for snapshots. They are loaded once and padded at
+    bottom and right into one batch, so snapshots take one forward pass
+    """
+
+    def __init__(
+        self,
+        dataset: data.Dataset[tuple[Tensor, Tensor]],
+        num_data: int = 1,
+        indices: Sequence[int] | None = None,
+    ) -> None:
+        """
+        Args:
+            indices: Items to load. If `None`, sample :param:`num_data` randomly
+        """
+        if indices is None:
+            indices = random.sample(range(len(dataset)), num_data)  # type: ignore
+        self.indices = list(indices)
+        items = [dataset[i] for i in self.indices]
+        self.sizes = [tuple(image.shape[-2:]) for image, _ in items]
+        height = max(h for h, _ in self.sizes)
+        width = max(w for _, w in self.sizes)
+
+        images: list[Tensor] = []
+        masks: list[Tensor] = []
+        for (image, mask), (h, w) in zip(items, self.sizes):
+            padding = [0, width - w, 0, height - h]
+            images.append(F.pad(image, padding))
+            masks.append(F.pad(mask, padding, value=-1))
+        self.images = torch.stack(images)
+        self.masks = torch.stack(masks)
+
+
 @torch.no_grad()
 def create_snapshots(
     model: nn.Module,
@@ -153,24 +606,44 @@ def create_snapshots(
     device: str,
     colors: Sequence[tuple[int, int, int]],
     num_data: int = 1,
+    upsample_budget: int | None = None,
+    channels_last: bool = False,
+    precision: Precision | None = None,
+    snapshot_batch: SnapshotBatch | None = None,
     **kwargs,
 ) -> list[list[Tensor]]:
     """Return list of images in sets of three: original, ground truth overlay,
     and prediction overlay.
 
     :param:`model` is assumed to be on :param:`device`
+
+    Args:
+        upsample_budget: See :func:`eval_one_epoch`
+        channels_last, precision: See :func:`forward_batch`
+        snapshot_batch: Reuse the loaded items. If `None`, sample :param:`num_data`
+            items from :param:`dataset`
     """
     model.eval()
+    if snapshot_batch is None:
+        snapshot_batch = SnapshotBatch(dataset, num_data)
+    images, masks = snapshot_batch.images, snapshot_batch.masks
+    logits, _ = forward_batch(
+        model,
+        images,
+        masks,
+        augment,
+        None,
+        device,
+        upsample=False,
+        channels_last=channels_last,
+        precision=precision,
+    )
+    preds, _ = upsample_argmax(logits["out"], masks.shape[-2:], upsample_budget)
+
+    mask_overlays = overlay_masks(images, masks, colors, (255, 255, 255))
+    pred_overlays = overlay_masks(images, preds.cpu(), colors)
     snapshots: list[list[Tensor]] = []
-    image_indices = random.sample(range(len(dataset)), num_data)  # type: ignore
-    for i in image_indices:
-        image, mask = dataset[i]
-        images, masks = image.unsqueeze(0), mask.unsqueeze(0)
-        logits, _ = forward_batch(model, images, masks, augment, None, device)
-        preds = torch.argmax(logits["out"], 1).to(torch.long)
-
-        image = images[0]
-        mask_overlay = draw_mask_on_image(image, masks[0], colors, (255, 255, 255))
-        pred_overlay = draw_mask_on_image(image, preds[0], colors)
-        snapshots.append([image, mask_overlay, pred_overlay])
+    for i, (h, w) in enumerate(snapshot_batch.sizes):
+        image_set = [images[i], mask_overlays[i], pred_overlays[i]]
+        snapshots.append([image[..., :h, :w] for image in image_set])
     return snapshots
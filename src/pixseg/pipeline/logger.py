@@ -94,6 +94,22 @@ class Logger:
     def on_checkpoint_saved(self, model_file: Path, checkpoint_file: Path):
         pass
 
+    def on_profile_saved(self, trace_file: Path, summary_file: Path):
+        """
+        Args:
+            trace_file: Chrome trace, which can be viewed in https://ui.perfetto.dev
+            summary_file: Table of operators sorted by self time
+        """
+        pass
+
+    def on_time_breakdown(self, job: str, step: int, times: dict[str, float]):
+        """
+        Args:
+            times: Average seconds per data of each phase in the steps. See
+                :class:`StepTimer`
+        """
+        pass
+
 
 class LocalLogger(Logger):
     CKPT_FOLDER = "ckpt"
@@ -189,6 +205,12 @@ class WandbLogger(Logger):
         metrics_with_job = {job + "/" + k: v for k, v in metrics.items()}
         self.run.log(metrics_with_job, step=step)
 
+    def on_time_breakdown(self, job: str, step: int, times: dict[str, float]):
+        if self.run is None:
+            return
+        times_with_job = {job + "/time/" + k: v for k, v in times.items()}
+        self.run.log(times_with_job, step=step)
+
     def on_snapshots_created(self, job: str, step: int, snapshots: list[list[Tensor]]):
         # wandb does not support viewing tables in different steps with slider
         # hopefully this will be implemented soon
@@ -258,6 +280,11 @@ class TensorboardLogger(Logger):
         for k, v in metrics.items():
             self.writer.add_scalar(job + "/" + k, v, step)
 
+    def on_time_breakdown(self, job: str, step: int, times: dict[str, float]):
+        if self.writer is None:
+            return
+        self.writer.add_scalars(job + "/time", times, step)
+
     def on_snapshots_created(self, job: str, step: int, snapshots: list[list[Tensor]]):
         if self.writer is None or not self.save_images:
             return
@@ -0,0 +1,152 @@
+import threading
+from queue import Empty, Full, Queue
+from typing import Iterator
+
+import torch
+from torch import Tensor
+from torch.utils import data
+from torchvision.transforms import v2
+
+_END = object()
+"""Marks the end of data in the queue"""
+
+
+class Prefetcher:
+    """Wrap data loader to prepare the next batch while the current batch is being
+    computed. Yield tuple of (images, masks) moved to :param:`device` and augmented
+
+    - On CUDA, batches are copied from pinned memory with non-blocking copies and
+        augmented in a side stream
+    - Otherwise, batches are loaded and moved in a background thread. Augmentations
+        are applied in the calling thread, since :class:`ImageMaskTransform` pairs
+        the random process of image and mask through the global random state.
+        For the same reason, this only works when data are loaded in workers, i.e.
+        `num_workers > 0`. Otherwise, batches are loaded synchronously
+
+    Example usage:
+    ```
+        for images, masks in Prefetcher(data_loader, "cuda", augment):
+            logits, losses = forward_batch(model, images, masks, None, ...)
+    ```
+    """
+
+    def __init__(
+        self,
+        data_loader: data.DataLoader,
+        device: str,
+        augment: v2.Transform | None = None,
+        num_prefetch: int = 2,
+        channels_last: bool = False,
+    ) -> None:
+        """
+        Args:
+            num_prefetch: Maximum number of batches loaded ahead in background thread
+            channels_last: Yield images in channels last memory format
+        """
+        self.data_loader = data_loader
+        self.device = device
+        self.augment = augment
+        self.num_prefetch = num_prefetch
+        self.channels_last = channels_last
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def __iter__(self) -> Iterator[tuple[Tensor, Tensor | None]]:
+        if torch.device(self.device).type == "cuda":
+            return self._iter_with_stream()
+        if self.data_loader.num_workers > 0:
+            return self._iter_with_thread()
+        return self._iter_sync()
+
+    def _move(self, images: Tensor, masks: Tensor | None, non_blocking=False):
+        if non_blocking and not images.is_pinned():
+            images = images.pin_memory()
+        images = images.to(self.device, non_blocking=non_blocking)
+        if self.channels_last and images.ndim == 4:
+            images = images.contiguous(memory_format=torch.channels_last)
+        if masks is not None:
+            if non_blocking and not masks.is_pinned():
+                masks = masks.pin_memory()
+            masks = masks.to(self.device, non_blocking=non_blocking)
+        return images, masks
+
+    def _apply_augment(self, images: Tensor, masks: Tensor | None):
+        if self.augment is None:
+            return images, masks
+        if masks is None:
+            return self.augment(images), None
+        return self.augment(images, masks)
+
+    def _iter_sync(self):
+        for images, masks in self.data_loader:
+            yield self._apply_augment(*self._move(images, masks))
+
+    def _iter_with_stream(self):
+        device = torch.device(self.device)
+        stream = torch.cuda.Stream(device)
+        batches = iter(self.data_loader)
+
+        def preload():
+            try:
+                images, masks = next(batches)
+            except StopIteration:
+                return None
+            with torch.cuda.stream(stream):
+                images, masks = self._move(images, masks, non_blocking=True)
+                return self._apply_augment(images, masks)
+
+        next_batch = preload()
+        while next_batch is not None:
+            current_stream = torch.cuda.current_stream(device)
+            current_stream.wait_stream(stream)
+            # tensors are created in side stream but consumed in current stream
+            for t in next_batch:
+                if t is not None:
+                    t.record_stream(current_stream)
+            batch = next_batch
+            next_batch = preload()
+            yield batch
+
+    def _iter_with_thread(self):
+        queue: Queue = Queue(self.num_prefetch)
+        stop = threading.Event()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for images, masks in self.data_loader:
+                    if not put(self._move(images, masks)):
+                        return
+            except BaseException as e:
+                put(e)
+                return
+            put(_END)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = queue.get()
+                if item is _END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield self._apply_augment(*item)
+        finally:
+            # release the producer if iteration stops early
+            stop.set()
+            while thread.is_alive():
+                try:
+                    queue.get(timeout=0.1)
+                except Empty:
+                    pass
+            thread.join()
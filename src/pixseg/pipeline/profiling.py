@@ -0,0 +1,60 @@
+"""Integrate :module:`torch.profiler` into the pipeline"""
+
+import logging
+from pathlib import Path
+from typing import Callable
+
+import torch
+from torch.profiler import ProfilerActivity, profile, schedule
+
+logger = logging.getLogger(__name__)
+
+ProfileCallback = Callable[[Path, Path], None]
+"""Called with the paths of Chrome trace and operator summary when they are saved"""
+
+
+def create_profiler(
+    folder: Path,
+    name: str,
+    device: str,
+    wait: int = 1,
+    warmup: int = 1,
+    active: int = 3,
+    row_limit: int = 50,
+    callback: ProfileCallback | None = None,
+    **kwargs,
+) -> profile:
+    """Create profiler which records one window of steps. Call `step()` after each
+    step. The Chrome trace and operator summary table are saved in :param:`folder`
+
+    Args:
+        name: Stem of the saved files
+        wait, warmup, active: Number of steps in each phase. See :func:`schedule`
+        row_limit: Number of operators in the summary table, sorted by self time
+        kwargs: See :class:`profile`, e.g. `record_shapes` or `profile_memory`
+    """
+    device_type = torch.device(device).type
+    activities = [ProfilerActivity.CPU]
+    if device_type == "cuda":
+        activities.append(ProfilerActivity.CUDA)
+    sort_by = (
+        "self_cpu_time_total" if device_type == "cpu" else "self_device_time_total"
+    )
+
+    def on_trace_ready(prof: profile):
+        folder.mkdir(parents=True, exist_ok=True)
+        trace_file = folder / f"{name}_trace.json"
+        prof.export_chrome_trace(str(trace_file))
+        summary_file = folder / f"{name}_ops.txt"
+        table = prof.key_averages().table(sort_by=sort_by, row_limit=row_limit)
+        summary_file.write_text(table, encoding="utf-8")
+        logger.info(f"Saved profiling results of {name} in {folder}")
+        if callback is not None:
+            callback(trace_file, summary_file)
+
+    return profile(
+        activities=activities,
+        schedule=schedule(wait=wait, warmup=warmup, active=active, repeat=1),
+        on_trace_ready=on_trace_ready,
+        **kwargs,
+    )
@@ -0,0 +1,77 @@
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from timeit import default_timer
+from typing import ContextManager, Iterator
+
+import torch
+
+
+class StepTimer:
+    """Accumulate wall time of each phase in the steps of an epoch, e.g. data wait,
+    forward and backward
+
+    The device is synchronized before and after each phase, so that asynchronous
+    work (e.g. cuda kernels) is counted in the phase launching it. This stalls the
+    pipeline, so only enable it when investigating
+
+    Example usage:
+    ```
+        timer = StepTimer("cuda")
+        foreach iter:
+            with timer.phase("forward"):
+                logits = model(images)
+            ms.store_measures(0, timer.pop_times())
+    ```
+    """
+
+    PREFIX = "time/"
+    """Prefix of the keys returned by :meth:`pop_times`"""
+
+    def __init__(self, device: str) -> None:
+        self.device = torch.device(device)
+        self._times: dict[str, float] = defaultdict(float)
+
+    def synchronize(self):
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        self.synchronize()
+        start_time = default_timer()
+        try:
+            yield
+        finally:
+            self.synchronize()
+            self._times[name] += default_timer() - start_time
+
+    def add(self, name: str, seconds: float):
+        """Add time measured elsewhere, e.g. waiting for the data loader"""
+        self._times[name] += seconds
+
+    def pop_times(self) -> dict[str, float]:
+        """Return the accumulated time of each phase with keys prefixed by
+        :attr:`PREFIX`, then reset"""
+        times = {self.PREFIX + k: v for k, v in self._times.items()}
+        self._times.clear()
+        return times
+
+
+def timed(timer: StepTimer | None, name: str) -> ContextManager:
+    """Same as :meth:`StepTimer.phase`, but do nothing if :param:`timer` is `None`"""
+    if timer is None:
+        return nullcontext()
+    return timer.phase(name)
+
+
+def split_times(metrics: dict[str, float]) -> tuple[dict[str, float], dict[str, float]]:
+    """Split the summary of :class:`MetricStore` into other metrics and the time of
+    each phase recorded by :class:`StepTimer`, with the prefix removed"""
+    others: dict[str, float] = {}
+    times: dict[str, float] = {}
+    for k, v in metrics.items():
+        if k.startswith(StepTimer.PREFIX):
+            times[k.removeprefix(StepTimer.PREFIX)] = v
+        else:
+            others[k] = v
+    return others, times
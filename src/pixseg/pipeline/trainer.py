@@ -1,32 +1,67 @@
 import logging
-import os
 import sys
-from contextlib import ExitStack
+from contextlib import ExitStack, nullcontext
 from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
-from typing import Any, Sequence, TypedDict
+from typing import Any, Literal, Sequence, TypedDict
 
 import numpy as np
 import torch
 from torch import GradScaler, nn
+from torch import distributed as dist
 from torch.optim import Optimizer
 from torch.optim.lr_scheduler import LRScheduler
 from torch.utils import data
 from torchvision.transforms import v2
 
 from ..utils.metrics import MetricStore
+from ..utils.rng import rng_state_dict
+from ..utils.tensor_file import load_state_file
 from . import engine
+from .checkpoint_writer import CheckpointWriter, ModelFormat, resolve_model_path
+from .compile import compile_function, compile_module
+from .distributed import (
+    ResumableDistributedSampler,
+    get_rank,
+    get_world_size,
+    is_distributed,
+    is_main_process,
+    unwrap_model,
+    wrap_model,
+)
 from .logger import Logger
+from .profiling import create_profiler
+from .timing import StepTimer, split_times
 
 logger = logging.getLogger(__name__)
 
 
 # use TypedDict for easier serialization
+class EpochProgress(TypedDict):
+    """Position in an unfinished epoch for resuming. Saved only after weight
+    updates, so no gradients are accumulated
+
+    Attributes:
+        iteration: number of training iterations done in the epoch
+        sampler_state_dict: see :class:`ResumableDistributedSampler`
+        rng_state_dicts: see :func:`rng_state_dict`. One for each process
+        metric_state_dict: training results so far, reduced across processes
+    """
+
+    epoch: int
+    iteration: int
+    sampler_state_dict: dict[str, int]
+    rng_state_dicts: list[dict[str, Any]]
+    metric_state_dict: dict[str, Any]
+
+
 class Checkpoint(TypedDict):
     """Checkpoint for restoring training. Model state is saved in a separate file.
 
     Attributes:
         model_path: relative path from the checkpoint file to the model file
+        progress: only saved in the middle of an epoch
     """
 
     model_path: str
@@ -34,6 +69,7 @@ class Checkpoint(TypedDict):
     lr_scheduler_state_dict: dict[str, Any]
     scaler_state_dict: dict[str, Any]
     job_metrics: dict[str, dict[str, list[float]]]
+    progress: EpochProgress | None
 
 
 @dataclass
@@ -48,11 +84,15 @@ class Trainer:
             trainer.load_checkpoint(checkpoint_file)
         trainer.train()
     ```
+
+    In distributed mode, the process group must be initialized and the data loaders
+    should use :class:`DistributedSampler`. See :module:`distributed`
     """
 
     # name of the jobs
     TRAIN = "train"
     VAL = "val"
+    VAL_SUBSET = "val_subset"
 
     # --- components
     model: nn.Module
@@ -78,12 +118,88 @@ class Trainer:
     """In the form of `"[max|min]:[metric]"` where metric must be a valid key in metrics"""
     loggers: Sequence[Logger] = ()
     num_snapshots: int = 4
+    progress_seconds: float | None = 1.0
+    """Minimum seconds between refreshing metrics on progress bar"""
+    progress_steps: int | None = None
+    """Number of steps between refreshing metrics on progress bar"""
+    prefetch: bool = False
+    """Move and augment the next batch while computing the current one"""
+    loss_stride: dict[str, int] | None = None
+    """Output stride to compute loss of each logits key. See :func:`forward_batch`"""
+    mask_downsample: Literal["nearest", "majority"] = "nearest"
+    upsample_budget: int | None = None
+    """Maximum number of elements of upsampled logits for predictions at once"""
+    per_image: bool = False
+    """Keep results of each validation image. See :class:`MetricStore`"""
+    worst_k: int = 0
+    """Number of validation images with the lowest IoU to log. Require `per_image`.
+    In distributed mode, only those of the main process are logged"""
+    compile_model: bool = False
+    """Compile model and criterion with :func:`torch.compile`"""
+    compile_step: bool = False
+    """Compile the whole :func:`forward_batch`"""
+    compile_options: dict[str, Any] | None = None
+    """kwargs of :func:`torch.compile`"""
+    explain_compile: bool = False
+    """Log graph breaks of the model on a validation image before compiling. See
+    :func:`explain_graph_breaks`"""
+    pad_to_multiple: int | None = None
+    """Pad images to multiple of this size. See :func:`forward_batch`"""
+    channels_last: bool = False
+    """Run model in channels last memory format"""
+    precision: engine.Precision | None = None
+    """Autocast precision. See :func:`autocast`"""
+    distributed: bool = False
+    """Train with :class:`DistributedDataParallel`. Only the main process logs and
+    saves checkpoints"""
+    sync_batch_norm: bool = True
+    """Convert batch norms to :class:`nn.SyncBatchNorm` in distributed mode"""
+    ddp_options: dict[str, Any] | None = None
+    """kwargs of :class:`DistributedDataParallel`"""
+    keep_last_checkpoints: int | None = None
+    """Number of latest step checkpoints to keep. Keep all if `None`"""
+    keep_top_checkpoints: int = 0
+    """Also keep this number of step checkpoints with the best `best_by`"""
+    checkpoint_every_n_steps: int | None = None
+    """Number of training iterations between checkpoints in the middle of epochs,
+    saved as latest for resuming. The train loader must use
+    :class:`ResumableDistributedSampler`"""
+    max_steps: int | None = None
+    """Train for this number of iterations instead of `num_epochs`. Then the metrics,
+    snapshots and checkpoints are made every `val_every_n_steps`, and `lr_scheduler`
+    steps after every weight update"""
+    val_every_n_steps: int | None = None
+    """Number of iterations between validations in `max_steps` mode. Validate only at
+    the end if `None`"""
+    subset_val_every_n_steps: int | None = None
+    """Number of iterations between quick validations on a fixed subset in
+    `max_steps` mode. Results are recorded as job `VAL_SUBSET`, which is not used
+    for `best_by`"""
+    subset_val_size: int = 100
+    """Number of validation data in the subset, spread evenly over the dataset"""
+    async_checkpoint: bool = True
+    """Write checkpoints in a background thread. See :class:`CheckpointWriter`"""
+    model_format: ModelFormat = "torch"
+    """Format of saved model files. "tensors" can be loaded lazily with
+    :func:`load_state_file`"""
+    time_breakdown: bool = False
+    """Record time of each phase in the steps with device synchronization. See
+    :class:`StepTimer`"""
+    profile_epoch: int | None = None
+    """Epoch to profile a window of steps with :module:`torch.profiler`. Results are
+    saved in `out_folder`. Only the train job is profiled in `max_steps` mode"""
+    profile_job: str = "train"
+    """Job to profile, i.e. `TRAIN` or `VAL`"""
+    profile_options: dict[str, Any] | None = None
+    """kwargs of :func:`create_profiler`, e.g. wait, warmup and active steps"""
 
     def __post_init__(self):
         if len(self.labels) != self.num_classes:
             raise ValueError(f"Labels have different size than num_classes")
         if len(self.colors) != self.num_classes:
             raise ValueError(f"Colors have different size than num_classes")
+        if self.worst_k > 0 and not self.per_image:
+            raise ValueError("worst_k requires per_image to be enabled")
 
         self.job_metrics: dict[str, dict[str, list[float]]] = {
             self.TRAIN: {},
@@ -91,133 +207,456 @@ class Trainer:
         }
         self.model.to(self.device)
         self.criterion.to(self.device)
+        if self.checkpoint_every_n_steps is not None and not isinstance(
+            self.train_loader.sampler, ResumableDistributedSampler
+        ):
+            raise ValueError(
+                "checkpoint_every_n_steps requires train loader with"
+                " ResumableDistributedSampler"
+            )
+        self.resume_progress: EpochProgress | None = None
+        # number of training iterations in each epoch and done since the start
+        self.epoch_iterations = len(self.train_loader)
+        self.global_step = 0
+        self.interval_ms: MetricStore | None = None
+        if self.subset_val_every_n_steps is not None:
+            self.subset_val_loader = self.create_subset_val_loader()
+
+        if self.channels_last:
+            self.model.to(memory_format=torch.channels_last)
+        if not engine.needs_grad_scaler(self.device, self.precision):
+            # a disabled scaler passes through scale, step and update
+            self.scaler = GradScaler(self.device, enabled=False)
+
+        # snapshots of each job use the same items throughout the run
+        self.snapshot_batches: dict[str, engine.SnapshotBatch] = {}
+        self.saved_steps: list[int] = []
+        self.checkpoint_writer = CheckpointWriter(
+            self._on_checkpoint_saved, self.async_checkpoint, self.model_format
+        )
+        self.timer = StepTimer(self.device) if self.time_breakdown else None
+        self.silent = False
+        if self.distributed:
+            if not is_distributed():
+                raise ValueError("Process group is not initialized for distributed")
+            ddp_options = self.ddp_options or {}
+            self.model = wrap_model(
+                self.model, self.device, self.sync_batch_norm, **ddp_options
+            )
+            if not is_main_process():
+                self.loggers = ()
+                self.out_folder = None
+                self.silent = True
+
+        self.forward_fn = engine.forward_batch
+        compile_options = self.compile_options or {}
+        if self.compile_model:
+            explain_inputs = None
+            if self.explain_compile:
+                image, _ = self.val_loader.dataset[0]
+                explain_inputs = [image.unsqueeze(0).to(self.device)]
+            compile_module(self.model, explain_inputs=explain_inputs, **compile_options)
+            compile_module(self.criterion, **compile_options)
+        if self.compile_step:
+            self.forward_fn = compile_function(engine.forward_batch, **compile_options)
 
     def train(self):
         with ExitStack() as stack:
             [stack.enter_context(logger) for logger in self.loggers]
+            # pending checkpoints are written before loggers exit
+            stack.callback(self.checkpoint_writer.close)
 
-            start_epoch = 0
-            if len(self.job_metrics[self.TRAIN]) > 0:
-                start_epoch = len(next(iter(self.job_metrics[self.TRAIN].values())))
-            for i in range(start_epoch, self.num_epochs):
-                self.run_one_epoch(i)
+            if self.max_steps is None:
+                self.train_epochs()
+            else:
+                self.train_steps()
 
             logger.info(f"Training completed")
 
+    def train_epochs(self):
+        """Train until :attr:`num_epochs`, validating after each epoch"""
+        start_epoch = 0
+        if len(self.job_metrics[self.TRAIN]) > 0:
+            start_epoch = len(next(iter(self.job_metrics[self.TRAIN].values())))
+        for i in range(start_epoch, self.num_epochs):
+            self.set_epoch(i)
+            self.run_one_epoch(i)
+
+    def train_steps(self):
+        """Train until :attr:`max_steps` iterations across epochs, validating every
+        :attr:`val_every_n_steps`"""
+        assert self.max_steps is not None
+        epoch, self.global_step = 0, 0
+        if self.resume_progress is not None:
+            epoch = self.resume_progress["epoch"]
+            self.global_step = (
+                epoch * self.epoch_iterations + self.resume_progress["iteration"]
+            )
+        while self.global_step < self.max_steps:
+            self.set_epoch(epoch)
+            self.run_epoch_steps(epoch)
+            epoch += 1
+
+    def set_epoch(self, epoch: int):
+        for loader in (self.train_loader, self.val_loader):
+            if isinstance(loader.sampler, data.DistributedSampler):
+                loader.sampler.set_epoch(epoch)
+
     def run_one_epoch(self, step: int):
         logger.info(f"----- Epoch [{step:>4}/{self.num_epochs}] -----")
-        train_ms = engine.train_one_epoch(
-            data_loader=self.train_loader,
-            augment=self.train_augment,
-            desc=self.TRAIN,
-            **self.__dict__,
-        )
+        train_ms = self.run_train_epoch(step)
         self.lr_scheduler.step()
+        if self.distributed:
+            train_ms.all_reduce()
         self.record_metrics(self.TRAIN, step, train_ms)
         self.save_snapshot(self.TRAIN, step, self.train_loader.dataset)
+        self.run_validation(step)
+        self.export_checkpoints(step)
 
-        val_ms = engine.eval_one_epoch(
-            data_loader=self.val_loader,
-            augment=self.val_augment,
-            desc=self.VAL,
-            **self.__dict__,
+    def run_epoch_steps(self, epoch: int):
+        """Train one epoch in :attr:`max_steps` mode, which may stop in the middle.
+        Validations and checkpoints are run by :meth:`on_train_step`"""
+        assert self.max_steps is not None
+        logger.info(
+            f"----- Epoch [{epoch:>4}] from step [{self.global_step:>6}/"
+            f"{self.max_steps}] -----"
+        )
+        train_ms = self.run_train_epoch(epoch)
+        if self.global_step < self.max_steps:
+            # the last iteration of epoch is not passed to callback
+            self.on_train_step(epoch + 1, 0, train_ms)
+
+    def run_train_epoch(self, epoch: int) -> MetricStore:
+        resume_kwargs = self.resume_epoch(epoch)
+        if self.max_steps is not None and "metric_store" not in resume_kwargs:
+            # keep training results since the last validation across epochs
+            resume_kwargs["metric_store"] = self.interval_ms
+        start_iteration = resume_kwargs.get("start_iteration", 0)
+        self.global_step = epoch * self.epoch_iterations + start_iteration
+        iteration_lr_scheduler = None if self.max_steps is None else self.lr_scheduler
+        train_profiler = self.create_profiler(self.TRAIN, epoch)
+        with train_profiler or nullcontext():
+            train_ms = engine.train_one_epoch(
+                data_loader=self.train_loader,
+                augment=self.train_augment,
+                desc=self.TRAIN,
+                profiler=train_profiler,
+                step_callback=partial(self.on_train_step, epoch),
+                iteration_lr_scheduler=iteration_lr_scheduler,
+                **resume_kwargs,
+                **self.__dict__,
+            )
+        if self.max_steps is not None:
+            self.interval_ms = train_ms
+        return train_ms
+
+    def run_validation(self, step: int, job: str = VAL):
+        """Evaluate on validation set, or the subset of :attr:`subset_val_size` if
+        :param:`job` is `VAL_SUBSET`. Every process must call this"""
+        data_loader = self.val_loader
+        if job == self.VAL_SUBSET:
+            data_loader = self.subset_val_loader
+        # profile by epoch, which is only known in epoch mode
+        val_profiler = None
+        if self.max_steps is None:
+            val_profiler = self.create_profiler(job, step)
+        with val_profiler or nullcontext():
+            val_ms = engine.eval_one_epoch(
+                data_loader=data_loader,
+                augment=self.val_augment,
+                desc=job,
+                profiler=val_profiler,
+                **self.__dict__,
+            )
+        if self.distributed:
+            val_ms.all_reduce()
+        self.record_metrics(job, step, val_ms)
+        if job == self.VAL:
+            self.save_snapshot(job, step, data_loader.dataset)
+
+    def on_train_step(self, epoch: int, iteration: int, ms: MetricStore) -> bool:
+        """Called after the weight updates of :func:`train_one_epoch`. Run the
+        validations and checkpoints due since the last call
+
+        Returns:
+            Whether to stop the epoch, i.e. :attr:`max_steps` is reached
+        """
+        last_step, step = self.global_step, epoch * self.epoch_iterations + iteration
+        self.global_step = step
+        if self.max_steps is None:
+            if _is_due(self.checkpoint_every_n_steps, last_step, step):
+                self.save_progress(epoch, iteration, ms)
+            return False
+
+        stop = step >= self.max_steps
+        if stop or _is_due(self.val_every_n_steps, last_step, step):
+            self.validate_steps(epoch, iteration, ms)
+            return stop
+        if _is_due(self.subset_val_every_n_steps, last_step, step):
+            self.run_validation(step, self.VAL_SUBSET)
+            self.model.train()
+        if _is_due(self.checkpoint_every_n_steps, last_step, step):
+            self.save_progress(epoch, iteration, ms)
+        return False
+
+    def validate_steps(self, epoch: int, iteration: int, ms: MetricStore):
+        """Record training results since the last validation, then validate and
+        save checkpoints in :attr:`max_steps` mode. Metrics are logged with the
+        global step, while checkpoints are indexed by the number of validations"""
+        num_validations = 0
+        if len(self.job_metrics[self.VAL]) > 0:
+            num_validations = len(next(iter(self.job_metrics[self.VAL].values())))
+        step = self.global_step
+        logger.info(f"----- Validate at step [{step:>6}/{self.max_steps}] -----")
+        if self.distributed:
+            ms.all_reduce()
+        self.record_metrics(self.TRAIN, step, ms)
+        ms.reset()
+        self.save_snapshot(self.TRAIN, step, self.train_loader.dataset)
+        self.run_validation(step)
+        self.model.train()
+        self.export_checkpoints(
+            num_validations, self.create_progress(epoch, iteration, ms)
+        )
+
+    def create_subset_val_loader(self) -> data.DataLoader:
+        dataset: Any = self.val_loader.dataset
+        size = min(self.subset_val_size, len(dataset))
+        indices = np.linspace(0, len(dataset) - 1, size).round().astype(int)
+        subset = data.Subset(dataset, indices.tolist())
+        sampler = None
+        if self.distributed:
+            sampler = ResumableDistributedSampler(subset, shuffle=False)
+        return data.DataLoader(
+            subset,
+            batch_size=self.val_loader.batch_size,
+            sampler=sampler,
+            num_workers=self.val_loader.num_workers,
+            collate_fn=self.val_loader.collate_fn,
+        )
+
+    def resume_epoch(self, step: int) -> dict[str, Any]:
+        """Restore :attr:`resume_progress` if it is in :param:`step`, and return the
+        kwargs of :func:`train_one_epoch` to continue from it"""
+        progress, self.resume_progress = self.resume_progress, None
+        if progress is None:
+            return {}
+        if progress["epoch"] != step:
+            logger.warning(f"Ignored progress of epoch {progress['epoch']} in {step}")
+            return {}
+        sampler = self.train_loader.sampler
+        if not isinstance(sampler, ResumableDistributedSampler):
+            raise ValueError("Resuming requires ResumableDistributedSampler")
+        rng_states = progress["rng_state_dicts"]
+        if len(rng_states) != get_world_size():
+            raise ValueError(
+                f"Cannot resume progress of {len(rng_states)} processes"
+                f" in {get_world_size()} processes"
+            )
+
+        sampler.load_state_dict(progress["sampler_state_dict"])
+        ms = MetricStore(self.num_classes, self.device)
+        # results are reduced before saving, so only count them once
+        if is_main_process():
+            ms.load_state_dict(progress["metric_state_dict"])
+        logger.info(f"Resuming epoch {step} from iteration {progress['iteration']}")
+        return {
+            "start_iteration": progress["iteration"],
+            "metric_store": ms,
+            "rng_state": rng_states[get_rank()],
+        }
+
+    def create_progress(
+        self, epoch: int, iteration: int, ms: MetricStore
+    ) -> EpochProgress:
+        """Capture the position after :param:`iteration` in :param:`epoch`, with the
+        training results so far in :param:`ms`. Every process must call this"""
+        batch_size = self.train_loader.batch_size
+        if batch_size is None:
+            raise ValueError("Cannot locate progress without batch_size of loader")
+
+        reduced_ms = MetricStore(self.num_classes, self.device)
+        reduced_ms.merge(ms)
+        rng_states = [rng_state_dict()]
+        if self.distributed:
+            reduced_ms.all_reduce()
+            rng_states = [{} for _ in range(get_world_size())]
+            dist.all_gather_object(rng_states, rng_state_dict())
+        return {
+            "epoch": epoch,
+            "iteration": iteration,
+            "sampler_state_dict": {
+                "epoch": epoch,
+                "start_index": iteration * batch_size,
+            },
+            "rng_state_dicts": rng_states,
+            "metric_state_dict": reduced_ms.state_dict(),
+        }
+
+    def save_progress(self, epoch: int, iteration: int, ms: MetricStore):
+        """Save checkpoint with :class:`EpochProgress` as latest. Every process must
+        call this"""
+        progress = self.create_progress(epoch, iteration, ms)
+        if self.out_folder is None:
+            return
+        logger.info(f"Saving progress of epoch {epoch} at iteration {iteration}")
+        self.checkpoint_writer.save(
+            unwrap_model(self.model).state_dict(),
+            self.create_checkpoint(progress),  # type: ignore
+            [_get_save_folder(self.out_folder, "latest", None)],
+        )
+
+    def create_profiler(self, job: str, step: int):
+        """Return profiler if :param:`job` in :param:`step` should be profiled"""
+        if self.out_folder is None:
+            return None
+        if self.profile_epoch != step or self.profile_job != job:
+            return None
+
+        def on_profile_saved(trace_file: Path, summary_file: Path):
+            for l in self.loggers:
+                l.on_profile_saved(trace_file, summary_file)
+
+        return create_profiler(
+            self.out_folder / "profile",
+            f"{job}_e{step:>04}",
+            self.device,
+            callback=on_profile_saved,
+            **(self.profile_options or {}),
         )
-        self.record_metrics(self.VAL, step, val_ms)
-        self.save_snapshot(self.VAL, step, self.val_loader.dataset)
-        self.export_checkpoints(step)
 
     def record_metrics(self, job: str, step: int, ms: MetricStore):
-        metrics = ms.summarize()
+        metrics, times = split_times(ms.summarize())
+        if len(times) > 0:
+            total = sum(times.values())
+            times_text = "| ".join(f"{k}={v / total:.1%}" for k, v in times.items())
+            logger.info(f"Time breakdown of {job} {step}: {times_text}")
+            for l in self.loggers:
+                l.on_time_breakdown(job, step, times)
         for l in self.loggers:
             l.on_job_epoch_ended(job, step, ms.confusion_matrix, metrics)
         metrics_text = "| ".join(f"{k}={v:.4f}" for k, v in metrics.items())
         logger.debug(f"Metrics for {job} {step}: {metrics_text}")
+        if ms.worst_k > 0:
+            worst_text = "| ".join(f"{i}={iou:.4f}" for i, iou in ms.worst_images())
+            logger.info(f"Worst images of {job} {step}: {worst_text}")
 
         for k, v in metrics.items():
-            self.job_metrics[job].setdefault(k, [])
+            self.job_metrics.setdefault(job, {}).setdefault(k, [])
             self.job_metrics[job][k].append(v)
         for l in self.loggers:
             l.on_running_metrics_updated(self.job_metrics)
 
     def save_snapshot(self, job: str, step: int, dataset: data.Dataset):
+        if not is_main_process():
+            return
+        if job not in self.snapshot_batches:
+            batch = engine.SnapshotBatch(dataset, self.num_snapshots)
+            self.snapshot_batches[job] = batch
+        # avoid collective calls of the wrapper, since only one process runs this
+        kwargs = self.__dict__ | {"model": unwrap_model(self.model)}
         snapshots = engine.create_snapshots(
             dataset=dataset,
             augment=self.val_augment,
-            num_data=self.num_snapshots,
-            **self.__dict__,
+            snapshot_batch=self.snapshot_batches[job],
+            **kwargs,
         )
         for l in self.loggers:
             l.on_snapshots_created(job, step, snapshots)
 
-    def export_checkpoints(self, step: int):
+    def export_checkpoints(self, step: int, progress: EpochProgress | None = None):
+        """Save the step, latest and best checkpoints in one write. See
+        :class:`CheckpointWriter`
+
+        Args:
+            step: Index in the validation metrics of :attr:`job_metrics`
+            progress: Position to resume if not at the end of an epoch
+        """
         if self.out_folder is None:
             return
 
+        folders: list[Path] = []
         if (step + 1) % self.checkpoint_steps == 0:
-            paths = _get_save_paths(self.out_folder, None, step)
-            _save_checkpoint(self, *paths)
-            for l in self.loggers:
-                l.on_checkpoint_saved(*paths)
-
+            folders.append(_get_save_folder(self.out_folder, None, step))
+            self.saved_steps.append(step)
         # always save latest checkpoint and model
-        paths = _get_save_paths(self.out_folder, "latest", None)
-        _save_checkpoint(self, *paths)
-        for l in self.loggers:
-            l.on_checkpoint_saved(*paths)
-
+        folders.append(_get_save_folder(self.out_folder, "latest", None))
         # save the best model
         best_index = _find_best_index(self.best_by, self.job_metrics[self.VAL])
         if best_index == step:
             logger.info("Found new best model")
-            paths = _get_save_paths(self.out_folder, "best", None)
-            _save_checkpoint(self, *paths)
-            for l in self.loggers:
-                l.on_checkpoint_saved(*paths)
+            folders.append(_get_save_folder(self.out_folder, "best", None))
+
+        removed_steps = self.prune_saved_steps()
+        self.checkpoint_writer.save(
+            unwrap_model(self.model).state_dict(),
+            self.create_checkpoint(progress),  # type: ignore
+            folders,
+            [_get_save_folder(self.out_folder, None, s) for s in removed_steps],
+        )
+
+    def create_checkpoint(self, progress: EpochProgress | None = None) -> Checkpoint:
+        return {
+            "model_path": "",  # filled by writer
+            "optimizer_state_dict": self.optimizer.state_dict(),
+            "lr_scheduler_state_dict": self.lr_scheduler.state_dict(),
+            "scaler_state_dict": self.scaler.state_dict(),
+            "job_metrics": self.job_metrics,
+            "progress": progress,
+        }
+
+    def prune_saved_steps(self) -> list[int]:
+        """Remove steps out of retention from :attr:`saved_steps` and return them"""
+        if self.keep_last_checkpoints is None:
+            return []
+        start = max(len(self.saved_steps) - self.keep_last_checkpoints, 0)
+        kept = set(self.saved_steps[start:])
+        if self.keep_top_checkpoints > 0:
+            algo_name, metric_key = self.best_by.split(":")
+            metrics = self.job_metrics[self.VAL][metric_key]
+            ranked = sorted(
+                self.saved_steps, key=lambda s: metrics[s], reverse=algo_name == "max"
+            )
+            kept.update(ranked[: self.keep_top_checkpoints])
+        removed = [s for s in self.saved_steps if s not in kept]
+        self.saved_steps = [s for s in self.saved_steps if s in kept]
+        return removed
+
+    def _on_checkpoint_saved(self, model_file: Path, checkpoint_file: Path):
+        for l in self.loggers:
+            l.on_checkpoint_saved(model_file, checkpoint_file)
 
     def load_checkpoint(self, checkpoint_file: Path):
         logger.info(f"Loading checkpoint in {checkpoint_file}")
         checkpoint: Checkpoint = torch.load(checkpoint_file, weights_only=True)
-        model_path = checkpoint_file / checkpoint["model_path"]
-        model_state_dict = torch.load(model_path, weights_only=True)
+        model_path = resolve_model_path(checkpoint_file, checkpoint["model_path"])
+        model_state_dict = load_state_file(model_path, weights_only=True)
 
-        self.model.load_state_dict(model_state_dict)
+        unwrap_model(self.model).load_state_dict(model_state_dict)
         self.optimizer.load_state_dict(checkpoint["optimizer_state_dict"])
         self.lr_scheduler.load_state_dict(checkpoint["lr_scheduler_state_dict"])
         self.scaler.load_state_dict(checkpoint["scaler_state_dict"])
         self.job_metrics = checkpoint["job_metrics"]
+        # older checkpoints do not have progress
+        self.resume_progress = checkpoint.get("progress")
 
 
-def _get_save_paths(folder: Path, name: str | None, step: int | None):
+def _get_save_folder(folder: Path, name: str | None, step: int | None) -> Path:
     """Provide exactly one of `name` or `step`
 
-    If step is provided, it will return path in a subfolder
+    If step is provided, it will return a subfolder of "steps"
     """
-    if folder is None:
-        return
     if name is None == step is None:
         raise ValueError("Accept exactly one of name or step")
-    model_file = folder / f"{name}_model.pth"
-    checkpoint_file = folder / f"{name}_checkpoint.pth"
     if step is not None:
-        model_file = folder / "model" / f"e{step:>04}.pth"
-        checkpoint_file = folder / "checkpoint" / f"e{step:>04}.pth"
-    return model_file, checkpoint_file
-
-
-def _save_checkpoint(trainer: Trainer, model_file: Path, checkpoint_file: Path):
-    model_file.parent.mkdir(exist_ok=True)
-    checkpoint_file.parent.mkdir(exist_ok=True)
-    model_state_dict = {k: v.cpu() for k, v in trainer.model.state_dict().items()}
-    torch.save(model_state_dict, model_file)
-
-    checkpoint: Checkpoint = {
-        "model_path": str(os.path.relpath(model_file, start=checkpoint_file)),
-        "optimizer_state_dict": trainer.optimizer.state_dict(),
-        "lr_scheduler_state_dict": trainer.lr_scheduler.state_dict(),
-        "scaler_state_dict": trainer.scaler.state_dict(),
-        "job_metrics": trainer.job_metrics,
-    }
-    torch.save(checkpoint, checkpoint_file)
+        return folder / "steps" / f"e{step:>04}"
+    return folder / str(name)
+
+
+def _is_due(interval: int | None, last_step: int, step: int) -> bool:
+    """Whether a multiple of :param:`interval` is passed from :param:`last_step`
+    to :param:`step`"""
+    return interval is not None and step // interval > last_step // interval
 
 
 def _find_best_index(best_by: str, metrics_list: dict[str, list[float]]) -> int:
@@ -1,9 +1,15 @@
+import heapq
 from collections import defaultdict
-from typing import cast
+from typing import Sequence, cast
 
 import numpy as np
 import torch
 from torch import Tensor
+from torch import distributed as dist
+from torch.nn import functional as F
+
+_RECORD_CHUNK = 1024
+"""Capacity of per-image records is kept in multiple of this number of rows"""
 
 
 class MetricStore:
@@ -17,22 +23,118 @@ class MetricStore:
             ms.store_measures(batch_size, { "loss": loss })
         metrics = ms.summarize()
     ```
+
+    For sharded evaluation, combine stores with :meth:`merge` (e.g. results from
+    process pools) or :meth:`all_reduce` (within :module:`torch.distributed`) before
+    summarizing. Metrics of each shard should not be averaged.
     """
 
-    def __init__(self, num_classes: int) -> None:
+    def __init__(
+        self,
+        num_classes: int,
+        device: torch.device | str | None = None,
+        per_image: bool = False,
+        worst_k: int = 0,
+    ) -> None:
+        """
+        Args:
+            device: If set, results are accumulated in a Tensor on this device and
+                only copied to host when :attr:`confusion_matrix` is read. Use the
+                device of the predictions to avoid host sync on every batch
+            per_image: Also keep per-class TP, FP and FN of each image in
+                :attr:`image_records`. The first dim of results is treated as batch
+            worst_k: Number of images with the lowest IoU to track. See
+                :meth:`worst_images`. Require :param:`per_image`
+        """
+        if worst_k > 0 and not per_image:
+            raise ValueError("worst_k requires per_image to be enabled")
         self.num_classes = num_classes
-        self.confusion_matrix: np.ndarray = np.zeros(
+        self.device = device
+        self.per_image = per_image
+        self.worst_k = worst_k
+        self._cm: np.ndarray | Tensor = np.zeros(
             [num_classes, num_classes], dtype=np.int_
         )
+        if device is not None:
+            self._cm = torch.zeros(
+                [num_classes, num_classes], dtype=torch.long, device=device
+            )
+        self._host_cm: np.ndarray | None = None  # cached copy of device results
+
+        # per-image results
+        self.num_images: int = 0
+        self._records = np.zeros([0, 3, num_classes], dtype=np.int32)
+        self._worst_heap: list[tuple[float, int]] = []  # (-iou, index)
 
         # store other useful info
         self.count_data: int = 0
-        self.measures: dict[str, float] = defaultdict(lambda: 0)
+        self.measures: dict[str, float] = defaultdict(float)  # picklable
+
+    @property
+    def confusion_matrix(self) -> np.ndarray:
+        """int array of shape (num_classes, num_classes)"""
+        if isinstance(self._cm, np.ndarray):
+            return self._cm
+        if self._host_cm is None:
+            self._host_cm = self._cm.numpy(force=True).astype(np.int_)
+        return self._host_cm
+
+    @property
+    def image_records(self) -> np.ndarray:
+        """int32 array of shape (num_images, 3, num_classes) in order of storing.
+        Second dim is the TP, FP and FN of each class. Empty if not :attr:`per_image`
+        """
+        return self._records[: self.num_images]
+
+    def worst_images(self) -> list[tuple[int, float]]:
+        """Return list of (image index, mean IoU) of the tracked worst images,
+        from the worst. Images without any valid pixels are skipped
+        """
+        worst = [(i, -neg_iou) for neg_iou, i in self._worst_heap]
+        return sorted(worst, key=lambda x: x[1])
 
     def store_results(self, truths: Tensor, preds: Tensor):
         """Values outside the range of `[0, num_classes)` will be ignored"""
-        results_cm = fast_confusion_matrix(truths, preds, self.num_classes)
-        self.confusion_matrix += results_cm.numpy()
+        device = "cpu" if self.device is None else self.device
+        if self.per_image:
+            cms = batched_confusion_matrix(truths, preds, self.num_classes, device)
+            results_cm = cms.sum(0)
+            tp = cms.diagonal(dim1=1, dim2=2)
+            fp = cms.sum(1) - tp
+            fn = cms.sum(2) - tp
+            records = torch.stack([tp, fp, fn], 1).to(torch.int32)
+            self._append_records(records.numpy(force=True))
+        else:
+            results_cm = fast_confusion_matrix(truths, preds, self.num_classes, device)
+
+        if isinstance(self._cm, np.ndarray):
+            self._cm += results_cm.numpy()
+        else:
+            self._cm += results_cm
+            self._host_cm = None
+
+    def _append_records(self, records: np.ndarray):
+        start, end = self.num_images, self.num_images + len(records)
+        if end > len(self._records):
+            # grow geometrically so appending is amortized linear
+            capacity = max(end, 2 * len(self._records))
+            capacity = -(-capacity // _RECORD_CHUNK) * _RECORD_CHUNK
+            grown = np.zeros([capacity, 3, self.num_classes], dtype=np.int32)
+            grown[:start] = self._records[:start]
+            self._records = grown
+        self._records[start:end] = records
+        self.num_images = end
+
+        if self.worst_k <= 0:
+            return
+        for i, iou in enumerate(records_miou(records).tolist()):
+            if np.isnan(iou):
+                continue
+            item = (-iou, start + i)
+            if len(self._worst_heap) < self.worst_k:
+                heapq.heappush(self._worst_heap, item)
+            elif item > self._worst_heap[0]:
+                heapq.heapreplace(self._worst_heap, item)
 
     def store_measures(self, num_data: int, measures: dict[str, float]):
         """Expect the measures in "sum" of all data"""
@@ -40,6 +142,119 @@ class MetricStore:
         for k, v in measures.items():
             self.measures[k] += v
 
+    def merge(self, other: "MetricStore"):
+        """Add all results and measures stored in :param:`other` into this store
+
+        Per-image records of :param:`other` are appended after the existing ones
+        """
+        if other.num_classes != self.num_classes:
+            raise ValueError(
+                f"Cannot merge MetricStore of {other.num_classes} classes"
+                f" into one of {self.num_classes} classes"
+            )
+        if self.per_image and not other.per_image:
+            raise ValueError("Cannot merge MetricStore without per-image records")
+        if self.per_image:
+            self._append_records(other.image_records)
+        if isinstance(self._cm, np.ndarray):
+            self._cm += other.confusion_matrix
+        else:
+            other_cm = other._cm
+            if isinstance(other_cm, np.ndarray):
+                other_cm = torch.from_numpy(other_cm)
+            self._cm += other_cm.to(self._cm.device)
+            self._host_cm = None
+
+        self.count_data += other.count_data
+        for k, v in other.measures.items():
+            self.measures[k] += v
+
+    def all_reduce(self, group: "dist.ProcessGroup | None" = None):
+        """Sum results and measures of this store across all processes in
+        :param:`group`, so that every process holds the global results
+
+        Every process must call this. Do nothing if :module:`torch.distributed` is not
+        initialized. Per-image records are kept local to each process.
+        """
+        if not dist.is_available() or not dist.is_initialized():
+            return
+
+        # processes may have stored different measures
+        all_keys: list[list[str]] = [[] for _ in range(dist.get_world_size(group))]
+        dist.all_gather_object(all_keys, sorted(self.measures.keys()), group=group)
+        keys = sorted(set(k for ks in all_keys for k in ks))
+
+        device = torch.device("cpu")
+        if isinstance(self._cm, Tensor):
+            device = self._cm.device
+        if dist.get_backend(group) == dist.Backend.NCCL:
+            device = torch.device("cuda", torch.cuda.current_device())
+
+        # integers and floats are reduced separately to keep counts exact
+        cm = torch.as_tensor(self._cm).to(device=device, dtype=torch.long)
+        counts = torch.cat([cm.flatten(), cm.new_tensor([self.count_data])])
+        measures = torch.tensor(
+            [self.measures[k] for k in keys], dtype=torch.float64, device=device
+        )
+        dist.all_reduce(counts, group=group)
+        dist.all_reduce(measures, group=group)
+
+        reduced_cm = counts[:-1].reshape(self.num_classes, self.num_classes)
+        if isinstance(self._cm, np.ndarray):
+            self._cm = reduced_cm.numpy(force=True).astype(np.int_)
+        else:
+            self._cm = reduced_cm.to(self._cm.device)
+            self._host_cm = None
+        self.count_data = int(counts[-1].item())
+        for k, v in zip(keys, measures.tolist()):
+            self.measures[k] = v
+
+    def reset(self):
+        """Clear all stored results and measures, e.g. to start another interval"""
+        if isinstance(self._cm, np.ndarray):
+            self._cm = np.zeros_like(self._cm)
+        else:
+            self._cm.zero_()
+            self._host_cm = None
+        self.num_images = 0
+        self._worst_heap = []
+        self.count_data = 0
+        self.measures = defaultdict(float)
+
+    def state_dict(self) -> dict:
+        """Return the stored results and measures, e.g. to resume an unfinished
+        epoch. Arrays are converted to Tensors for `torch.load(weights_only=True)`"""
+        return {
+            "confusion_matrix": torch.as_tensor(self._cm).cpu(),
+            "num_images": self.num_images,
+            "records": torch.from_numpy(self.image_records.copy()),
+            "count_data": self.count_data,
+            "measures": dict(self.measures),
+        }
+
+    def load_state_dict(self, state_dict: dict):
+        """Replace the stored results and measures with those of :meth:`state_dict`"""
+        cm: Tensor = state_dict["confusion_matrix"]
+        if cm.shape != (self.num_classes, self.num_classes):
+            raise ValueError(
+                f"Cannot load confusion matrix of shape {tuple(cm.shape)} into"
+                f" MetricStore of {self.num_classes} classes"
+            )
+        if isinstance(self._cm, np.ndarray):
+            self._cm = cm.numpy().astype(np.int_)
+        else:
+            self._cm = cm.to(self._cm.device, torch.long)
+            self._host_cm = None
+
+        # worst images are tracked again from the records
+        self.num_images = 0
+        self._records = np.zeros([0, 3, self.num_classes], dtype=np.int32)
+        self._worst_heap = []
+        if self.per_image:
+            self._append_records(state_dict["records"].numpy())
+        self.count_data = state_dict["count_data"]
+        self.measures = defaultdict(float, state_dict["measures"])
+
     def summarize(self) -> dict[str, float]:
         """Return the average metrics and measures
 
@@ -51,6 +266,204 @@ class MetricStore:
         return metrics_from_confusion(self.confusion_matrix) | avg_measures
 
 
+class CalibrationStore:
+    """Accumulate max-softmax confidence against correctness in fixed bins, so
+    calibration metrics can be computed without storing probabilities
+
+    Example usage:
+    ```
+        cs = CalibrationStore(10)
+        foreach iter:
+            cs.store_logits(ground_truths, logits)
+        metrics = cs.summarize()
+    ```
+    """
+
+    def __init__(
+        self,
+        num_classes: int,
+        num_bins: int = 15,
+        device: torch.device | str | None = None,
+    ) -> None:
+        """
+        Args:
+            num_bins: Number of equal-width bins of confidence in `[0, 1]`
+            device: Device to accumulate the bins. Use the device of the logits to
+                avoid host sync on every batch
+        """
+        self.num_classes = num_classes
+        self.num_bins = num_bins
+        # rows are count, sum of confidence, and number of correct predictions
+        self._bins = torch.zeros([3, num_bins], dtype=torch.float64, device=device)
+
+    def store_logits(self, truths: Tensor, logits: Tensor):
+        """
+        Args:
+            truths: int Tensor (B, H, W). Values outside `[0, num_classes)` are ignored
+            logits: float Tensor (B, num_classes, H, W) of the same size as truths
+        """
+        device = self._bins.device
+        with torch.autocast(device.type, enabled=False):
+            probs = logits.detach().to(device, torch.float32).softmax(1)
+        confidences, preds = probs.max(1)
+        self.store_confidences(truths, preds, confidences)
+
+    def store_confidences(self, truths: Tensor, preds: Tensor, confidences: Tensor):
+        """Same as :meth:`store_logits` when predictions and their max-softmax
+        probabilities are already computed
+
+        Args:
+            truths, preds: int Tensor (B, H, W)
+            confidences: float Tensor (B, H, W)
+        """
+        device = self._bins.device
+        confidences = confidences.detach().to(device, torch.float32).flatten()
+        preds = preds.detach().to(device).flatten()
+        truths = truths.detach().to(device).flatten()
+
+        valid = (truths >= 0) & (truths < self.num_classes)
+        bin_indices = (confidences * self.num_bins).long().clamp_(max=self.num_bins - 1)
+        # invalid pixels go to an extra bin to avoid host sync by boolean indexing
+        bin_indices = torch.where(valid, bin_indices, self.num_bins)
+        num_bins = self.num_bins + 1
+        correct = (preds == truths).to(torch.float64)
+        self._bins[0] += torch.bincount(bin_indices, minlength=num_bins)[:-1]
+        self._bins[1] += torch.bincount(
+            bin_indices, confidences.to(torch.float64), minlength=num_bins
+        )[:-1]
+        self._bins[2] += torch.bincount(bin_indices, correct, minlength=num_bins)[:-1]
+
+    def reliability(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return arrays of shape (num_bins,) for reliability diagram: mean confidence,
+        accuracy and number of pixels in each bin. Empty bins have `nan` values
+        """
+        counts, confidence_sums, correct_sums = self._bins.numpy(force=True)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return confidence_sums / counts, correct_sums / counts, counts
+
+    def summarize(self) -> dict[str, float]:
+        """Return calibration metrics
+
+        Returns:
+            A dictionary of scores
+            - "ece": expected calibration error
+            - "mce": maximum calibration error
+        """
+        confidences, accuracies, counts = self.reliability()
+        non_empty = counts > 0
+        gaps = np.abs(confidences - accuracies)[non_empty]
+        weights = counts[non_empty] / counts.sum()
+        return {
+            "ece": float((gaps * weights).sum()),
+            "mce": float(gaps.max()) if len(gaps) > 0 else 0.0,
+        }
+
+
+class BoundaryStore:
+    """Accumulate results near the boundaries of segments for boundary IoU and
+    trimap accuracy
+
+    Boundaries are found for all classes at once by morphology on the label maps.
+    See :func:`label_boundary`
+    """
+
+    def __init__(
+        self,
+        num_classes: int,
+        widths: Sequence[int] = (3,),
+        device: torch.device | str | None = None,
+    ) -> None:
+        """
+        Args:
+            widths: Distances in pixels from the boundaries to be included. Each width
+                gives its own set of metrics
+            device: Device to accumulate the results. Use the device of the predictions
+                to avoid host sync on every batch
+        """
+        self.num_classes = num_classes
+        self.widths = widths
+        # for each width: intersection, truth area and prediction area of each class
+        self._areas = torch.zeros(
+            [len(widths), 3, num_classes], dtype=torch.long, device=device
+        )
+        # for each width: correct pixels and total pixels in trimap
+        self._trimap = torch.zeros([len(widths), 2], dtype=torch.long, device=device)
+
+    def store_results(self, truths: Tensor, preds: Tensor):
+        """
+        Args:
+            truths, preds: int Tensor (B, H, W). Truths outside `[0, num_classes)` are
+                ignored
+        """
+        device = self._areas.device
+        truths = truths.detach().to(device)
+        preds = preds.detach().to(device)
+        num_classes = self.num_classes
+        valid = (truths >= 0) & (truths < num_classes)
+        correct = valid & (truths == preds)
+        valid_preds = valid & (preds >= 0) & (preds < num_classes)
+
+        for i, width in enumerate(self.widths):
+            truth_band = label_boundary(truths, width) & valid
+            pred_band = label_boundary(preds, width) & valid_preds
+            # excluded pixels go to an extra bin
+            regions = [
+                torch.where(truth_band & pred_band & correct, truths, num_classes),
+                torch.where(truth_band, truths, num_classes),
+                torch.where(pred_band, preds, num_classes),
+            ]
+            for j, region in enumerate(regions):
+                counts = torch.bincount(region.flatten(), minlength=num_classes + 1)
+                self._areas[i, j] += counts[:num_classes]
+
+            self._trimap[i, 0] += (truth_band & correct).sum()
+            self._trimap[i, 1] += truth_band.sum()
+
+    def summarize(self) -> dict[str, float]:
+        """Return the metrics of each width `w`
+
+        Returns:
+            A dictionary of scores
+            - "biou_w{w}": mean boundary IoU of classes appeared in the boundaries
+            - "trimap_acc_w{w}": pixel accuracy within truth boundaries
+        """
+        areas = self._areas.numpy(force=True).astype(np.float64)
+        trimap = self._trimap.numpy(force=True)
+        metrics: dict[str, float] = {}
+        for i, width in enumerate(self.widths):
+            intersection, truth_area, pred_area = areas[i]
+            union = truth_area + pred_area - intersection
+            present = union > 0
+            class_ious = intersection[present] / union[present]
+            miou = class_ious.mean() if len(class_ious) > 0 else 0.0
+            metrics[f"biou_w{width}"] = float(miou)
+
+            correct, total = trimap[i]
+            metrics[f"trimap_acc_w{width}"] = float(correct / max(total, 1))
+        return metrics
+
+
+def label_boundary(labels: Tensor, width: int) -> Tensor:
+    """Find pixels within :param:`width` (chessboard distance) of a pixel with
+    another label. This is the same as subtracting the erosion from each class mask,
+    but all classes are processed at once by max pooling.
+
+    Pixels outside the image are not considered as another label.
+
+    Args:
+        labels: int Tensor (B, H, W)
+
+    Returns:
+        bool Tensor (B, H, W)
+    """
+    # float32 represents labels exactly up to 2^24
+    x = labels.unsqueeze(1).to(torch.float32)
+    kernel_size = 2 * width + 1
+    dilated = F.max_pool2d(x, kernel_size, stride=1, padding=width)
+    eroded = -F.max_pool2d(-x, kernel_size, stride=1, padding=width)
+    return (dilated != eroded).squeeze(1)
+
+
 def metrics_from_confusion(cm: np.ndarray) -> dict[str, float]:
     """Calculate metrics from confusion matrix
 
@@ -93,31 +506,206 @@ def metrics_from_confusion(cm: np.ndarray) -> dict[str, float]:
     return metrics
 
 
-def fast_confusion_matrix(truths: Tensor, preds: Tensor, num_classes: int) -> Tensor:
+def fold_confusion_matrix(
+    cm: np.ndarray, lut: Sequence[int], num_classes: int
+) -> np.ndarray:
+    """Map confusion matrix of fine classes into a coarser label space, so metrics of
+    derived label sets are available from a single evaluation
+
+    The results are exact only if each fine class belongs to one coarse class.
+    Classes mapped outside `[0, num_classes)` are dropped, the same as being ignored
+    in :func:`fast_confusion_matrix`.
+
+    Args:
+        cm: int array (num_fine_classes, num_fine_classes)
+        lut: Coarse class of each fine class
+        num_classes: Number of coarse classes
+
+    Returns:
+        int array (num_classes, num_classes)
+    """
+    lut_arr = np.asarray(lut)
+    if len(lut_arr) != cm.shape[0]:
+        raise ValueError(
+            f"Expect lut of size {cm.shape[0]} for confusion matrix, but got {len(lut)}"
+        )
+    fine_ids = np.flatnonzero((lut_arr >= 0) & (lut_arr < num_classes))
+    fold = np.zeros([len(lut_arr), num_classes], dtype=cm.dtype)
+    fold[fine_ids, lut_arr[fine_ids]] = 1
+    return fold.T @ cm @ fold
+
+
+def lut_from_groups(
+    groups: Sequence[Sequence[int]], num_classes: int, extra_id: int
+) -> tuple[int, ...]:
+    """Create look-up table for :func:`fold_confusion_matrix` from class groups, like
+    the `class_groups` of :class:`CityscapesSubset`
+
+    Args:
+        groups: Fine classes of each coarse class
+        num_classes: Number of fine classes
+        extra_id: Coarse class for the remaining fine classes
+    """
+    lut = [extra_id] * num_classes
+    for coarse_id, fine_ids in enumerate(groups):
+        for i in fine_ids:
+            lut[i] = coarse_id
+    return tuple(lut)
+
+
+def bootstrap_metrics(
+    records: np.ndarray,
+    num_resamples: int = 1000,
+    confidence: float = 0.95,
+    chunk_size: int = 100,
+    generator: torch.Generator | None = None,
+    device: torch.device | str = "cpu",
+) -> dict[str, tuple[float, float]]:
+    """Estimate confidence intervals of metrics by resampling images with replacement
+
+    Each resample is summed by a weighted sum of records, i.e. matrix product of
+    sampling counts (B, N) and records (N, 3C), so no Python loop over resamples or
+    images is needed.
+
+    Args:
+        records: int array (num_images, 3, num_classes). See
+            :attr:`MetricStore.image_records`
+        confidence: Width of the percentile interval
+        chunk_size: Number of resamples computed at once. Bound the memory by
+            `chunk_size * num_images`
+        device: Device for the computations
+
+    Returns:
+        Mapping of metric to (lower bound, upper bound). Same metrics as
+            :func:`metrics_from_confusion`
+    """
+    num_images, _, num_classes = records.shape
+    flat_records = torch.from_numpy(records.reshape(num_images, -1))
+    flat_records = flat_records.to(device=device, dtype=torch.float64)
+
+    resampled_metrics: dict[str, list[Tensor]] = defaultdict(list)
+    for start in range(0, num_resamples, chunk_size):
+        size = min(chunk_size, num_resamples - start)
+        indices = torch.randint(0, num_images, [size, num_images], generator=generator)
+        weights = torch.zeros([size, num_images], dtype=torch.float64)
+        weights.scatter_add_(1, indices, torch.ones_like(weights))
+        counts = weights.to(device) @ flat_records
+        tp, fp, fn = counts.reshape(size, 3, num_classes).unbind(1)
+        for k, v in _batched_metrics_from_counts(tp, fp, fn).items():
+            resampled_metrics[k].append(v)
+
+    alpha = (1 - confidence) / 2
+    q = torch.tensor([alpha, 1 - alpha], dtype=torch.float64, device=device)
+    intervals: dict[str, tuple[float, float]] = {}
+    for k, v in resampled_metrics.items():
+        low, high = torch.quantile(torch.cat(v), q).tolist()
+        intervals[k] = (low, high)
+    return intervals
+
+
+def _batched_metrics_from_counts(
+    tp: Tensor, fp: Tensor, fn: Tensor
+) -> dict[str, Tensor]:
+    """Same as :func:`metrics_from_confusion` for Tensors (B, num_classes)"""
+    epsilon = 1e-6
+    total = (tp + fn).sum(1)
+    class_ious = tp / (tp + fp + fn + epsilon)
+    return {
+        "acc": tp.sum(1) / total,
+        "macc": (tp / (tp + fn + epsilon)).mean(1),
+        "miou": class_ious.mean(1),
+        "fwiou": (class_ious * (tp + fn) / total.unsqueeze(1)).sum(1),
+        "dice": (2 * tp / (2 * tp + fp + fn + epsilon)).mean(1),
+    }
+
+
+def records_miou(records: np.ndarray) -> np.ndarray:
+    """Calculate mean IoU of each per-image record
+
+    Only classes appearing in either truth or prediction are averaged
+
+    Args:
+        records: int array (num_images, 3, num_classes) of TP, FP and FN. See
+            :attr:`MetricStore.image_records`
+
+    Returns:
+        float array (num_images,). `nan` if the image has no valid pixels
+    """
+    tp, fp, fn = records[:, 0], records[:, 1], records[:, 2]
+    union = (tp + fp + fn).astype(np.float64)
+    present = union > 0
+    class_ious = np.divide(tp, union, out=np.zeros_like(union), where=present)
+    num_present = present.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return class_ious.sum(axis=1) / num_present
+
+
+def fast_confusion_matrix(
+    truths: Tensor,
+    preds: Tensor,
+    num_classes: int,
+    device: torch.device | str | None = "cpu",
+) -> Tensor:
     """Calculate the confusion matrix in Tensor
 
     This function is faster than :module:`sklearn.metrics` since it doesn't convert
     to numpy array every single time. All indices outside the range of `[0, num_classes)`
     are ignored.
 
+    Args:
+        device: Where the computation happens. If `None`, use the device of inputs
+
     Returns:
         A confusion matrix *(int Tensor (N, N))* where element at `[i, j]` is equal to
             the number of ground truths in class `i` and predicted to be class `j`
     """
-    truths = truths.detach().cpu().flatten()
-    preds = preds.detach().cpu().flatten()
+    truths = truths.detach().flatten()
+    preds = preds.detach().flatten()
+    if device is not None:
+        truths = truths.to(device)
+        preds = preds.to(device)
     in_range = (
         (truths >= 0) & (truths < num_classes) & (preds >= 0) & (preds < num_classes)
     )
-    truths = truths[in_range]
-    preds = preds[in_range]
     # combine to single tensor first to get frequency
-    indices = truths * num_classes + preds
-    matrix = torch.bincount(indices, minlength=num_classes * num_classes)
+    # ignored values go to an extra bin, since boolean indexing will sync with host
+    num_bins = num_classes * num_classes
+    indices = torch.where(in_range, truths * num_classes + preds, num_bins)
+    matrix = torch.bincount(indices, minlength=num_bins + 1)[:num_bins]
     matrix = matrix.reshape(num_classes, num_classes)
     return matrix
 
 
+def batched_confusion_matrix(
+    truths: Tensor,
+    preds: Tensor,
+    num_classes: int,
+    device: torch.device | str | None = "cpu",
+) -> Tensor:
+    """Same as :func:`fast_confusion_matrix` but calculate separately for each item
+    in the first dim
+
+    Returns:
+        int Tensor (B, N, N)
+    """
+    batch_size = truths.size(0)
+    truths = truths.detach().reshape(batch_size, -1)
+    preds = preds.detach().reshape(batch_size, -1)
+    if device is not None:
+        truths = truths.to(device)
+        preds = preds.to(device)
+    in_range = (
+        (truths >= 0) & (truths < num_classes) & (preds >= 0) & (preds < num_classes)
+    )
+    num_bins = num_classes * num_classes
+    offsets = torch.arange(batch_size, device=truths.device).unsqueeze(1) * num_bins
+    indices = truths * num_classes + preds + offsets
+    indices = torch.where(in_range, indices, batch_size * num_bins)
+    matrix = torch.bincount(indices.flatten(), minlength=batch_size * num_bins + 1)
+    matrix = matrix[: batch_size * num_bins]
+    return matrix.reshape(batch_size, num_classes, num_classes)
+
+
 def _test():
     num_classes = 10
     truths = torch.randint(0, num_classes, [160, 90]).flatten()
@@ -24,3 +24,40 @@ def set_rng_state(random_state, np_random_state, torch_random_state):
     random.setstate(random_state)
     np.random.set_state(np_random_state)
     torch.set_rng_state(torch_random_state)
+
+
+def rng_state_dict() -> dict:
+    """Same as :func:`get_rng_state` but also with cuda states, in types that can be
+    loaded by `torch.load(weights_only=True)`"""
+    np_state = np.random.get_state(legacy=False)
+    state = {
+        "random": random.getstate(),
+        "numpy": {
+            "key": torch.from_numpy(np_state["state"]["key"].astype(np.int64)),
+            "pos": np_state["state"]["pos"],
+            "has_gauss": np_state["has_gauss"],
+            "gauss": np_state["gauss"],
+        },
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available() and torch.cuda.is_initialized():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def load_rng_state_dict(state: dict):
+    """Restore the states returned by :func:`rng_state_dict`"""
+    np_state = state["numpy"]
+    key = np_state["key"].numpy().astype(np.uint32)
+    random.setstate(state["random"])
+    np.random.set_state(
+        {
+            "bit_generator": "MT19937",
+            "state": {"key": key, "pos": np_state["pos"]},
+            "has_gauss": np_state["has_gauss"],
+            "gauss": np_state["gauss"],
+        }
+    )
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
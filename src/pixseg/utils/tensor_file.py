@@ -0,0 +1,157 @@
+"""Read and write state dicts in the safetensors layout without pickle
+
+The file starts with the byte size of the header (little-endian uint64), then the
+header in JSON, then the raw data of all tensors. The header maps each key to its
+dtype, shape and byte range in the data. Tensors are sorted by descending element
+size, so every tensor is aligned to its element size and can be mapped from the
+file directly.
+"""
+
+import json
+import mmap
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+
+import torch
+from torch import Tensor
+
+SUFFIX = ".safetensors"
+
+_ALIGNMENT = 8
+"""Byte alignment of the header size"""
+
+_DTYPES: dict[str, torch.dtype] = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+    "F8_E4M3": torch.float8_e4m3fn,
+    "F8_E5M2": torch.float8_e5m2,
+}
+_DTYPE_NAMES = {v: k for k, v in _DTYPES.items()}
+
+
+@dataclass
+class TensorInfo:
+    """Entry of a tensor in the header"""
+
+    dtype: torch.dtype
+    shape: tuple[int, ...]
+    start: int
+    """Byte offset from the start of data"""
+    end: int
+
+
+def save_tensor_file(
+    state_dict: dict[str, Tensor], path: Path, metadata: dict[str, str] | None = None
+):
+    """Save :param:`state_dict` in the tensor file format. Tensors are moved to cpu
+    and made contiguous. Shared storages are saved separately
+    """
+    tensors = {k: v.detach().cpu().contiguous() for k, v in state_dict.items()}
+    keys = sorted(tensors, key=lambda k: (-tensors[k].element_size(), k))
+    header: dict[str, dict] = {"__metadata__": metadata or {}}
+    offset = 0
+    for k in keys:
+        v = tensors[k]
+        if v.dtype not in _DTYPE_NAMES:
+            raise ValueError(f"Unsupported dtype {v.dtype} of {k}")
+        nbytes = v.numel() * v.element_size()
+        header[k] = {
+            "dtype": _DTYPE_NAMES[v.dtype],
+            "shape": list(v.shape),
+            "data_offsets": [offset, offset + nbytes],
+        }
+        offset += nbytes
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    # pad with spaces so the data starts aligned
+    header_bytes += b" " * (-(len(header_bytes) + 8) % _ALIGNMENT)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for k in keys:
+            v = tensors[k]
+            if v.numel() > 0:
+                # numpy does not support all dtypes, but their bytes
+                f.write(v.reshape(-1).view(torch.uint8).numpy())
+
+
+def read_tensor_header(path: Path) -> tuple[dict[str, TensorInfo], int]:
+    """Return the info of each tensor and the byte offset of data in the file,
+    without reading the data"""
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header: dict[str, dict] = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    infos = {
+        k: TensorInfo(_DTYPES[v["dtype"]], tuple(v["shape"]), *v["data_offsets"])
+        for k, v in header.items()
+    }
+    return infos, 8 + header_size
+
+
+def load_tensor_file(
+    path: Path, keys: Iterable[str] | None = None, prefixes: Iterable[str] = ()
+) -> dict[str, Tensor]:
+    """Load tensors from file as zero-copy views of a private memory map. The data
+    are only read from disk when accessed, and modifying them does not change the
+    file. Use `.clone()` or `.to(device)` to get independent Tensors
+
+    Args:
+        keys: Only load these keys. All keys if `None`
+        prefixes: Only load keys starting with any of them, e.g. "backbone."
+    """
+    infos, data_start = read_tensor_header(path)
+    key_set = None if keys is None else set(keys)
+    prefixes = tuple(prefixes)
+    selected = [
+        k
+        for k in infos
+        if (key_set is None or k in key_set)
+        and (len(prefixes) == 0 or k.startswith(prefixes))
+    ]
+
+    with open(path, "rb") as f:
+        # the map stays alive while any view references it
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    state_dict: dict[str, Tensor] = {}
+    for k in selected:
+        info = infos[k]
+        numel = (info.end - info.start) // info.dtype.itemsize
+        if numel == 0:
+            state_dict[k] = torch.empty(info.shape, dtype=info.dtype)
+            continue
+        flat = torch.frombuffer(
+            buffer, dtype=info.dtype, count=numel, offset=data_start + info.start
+        )
+        state_dict[k] = flat.view(info.shape)
+    return state_dict
+
+
+def load_state_file(
+    path: Path | str, prefixes: Iterable[str] = (), **kwargs
+) -> dict[str, Tensor]:
+    """Load state dict saved by :func:`save_tensor_file` if the file has
+    :data:`SUFFIX`, or by :func:`torch.save` otherwise
+
+    Args:
+        prefixes: Only keep keys starting with any of them. See :func:`load_tensor_file`
+        kwargs: See :func:`torch.load`
+    """
+    path = Path(path)
+    if path.suffix == SUFFIX:
+        return load_tensor_file(path, prefixes=prefixes)
+    state_dict: dict[str, Tensor] = torch.load(path, **kwargs)
+    prefixes = tuple(prefixes)
+    if len(prefixes) > 0:
+        state_dict = {k: v for k, v in state_dict.items() if k.startswith(prefixes)}
+    return state_dict
@@ -6,6 +6,7 @@ import PIL
 import PIL.Image
 import torch
 from torch import Tensor, nn
+from torch.nn import functional as F
 from torchvision.transforms import v2
 from torchvision.transforms.v2 import functional as TF
 from torchvision.transforms.v2._geometry import _FillType
@@ -104,11 +105,25 @@ class SafeRandomCrop(v2.Transform):
         raise ValueError(f"Input of type {type(inpt)} not supported")
 
 
+def restore_memory_format(output: Tensor, reference: Tensor) -> Tensor:
+    """Return :param:`output` in channels last format if :param:`reference` is a
+    batch in channels last format. Ops like warping allocate contiguous outputs,
+    which would otherwise force layout conversions in every layer of the model
+    """
+    if reference.ndim != 4 or output.ndim != 4 or reference.is_contiguous():
+        return output
+    if not reference.is_contiguous(memory_format=torch.channels_last):
+        return output
+    return output.contiguous(memory_format=torch.channels_last)
+
+
 class ImageMaskTransform(nn.Module):
     """Data transform for semantic segmentation.
 
     Apply transforms on image and mask. Random process will be fixed on both sides if they
     are applied in the same order.
+
+    Channels last batches of images stay channels last.
     """
 
     # inherit from nn.Module for custom forward
@@ -122,7 +137,7 @@ class ImageMaskTransform(nn.Module):
         self, image: Tensor, mask: Tensor | None = None
     ) -> tuple[Tensor, Tensor | None]:
         rng_state = get_rng_state()
-        image = self.image(image)
+        image = restore_memory_format(self.image(image), image)
         if mask is not None:
             set_rng_state(*rng_state)
             mask = self.mask(mask)
@@ -215,3 +230,260 @@ class SegmentationAugment(v2.Compose):
             ]
         )
         super().__init__([ImageMaskTransform(image_transform, mask_transform)])
+
+
+def downsample_mask(
+    masks: Tensor, stride: int, mode: Literal["nearest", "majority"] = "nearest"
+) -> Tensor:
+    """Downsample masks to size `ceil(size / stride)`
+
+    Args:
+        masks: int Tensor (B, H, W)
+        mode: If `"majority"`, use the most frequent value of each block. Smaller value
+            wins in ties. Blocks at the edges are padded by replicating values
+    """
+    H, W = masks.shape[-2:]
+    size = [-(-H // stride), -(-W // stride)]
+    x = masks.unsqueeze(1).to(torch.float32)  # exact for labels up to 2^24
+    if mode == "nearest":
+        x = F.interpolate(x, size, mode="nearest")
+        return x.squeeze(1).to(masks.dtype)
+    if mode != "majority":
+        raise ValueError(f"Unknown mode {mode}. Expect one of 'nearest', 'majority'")
+
+    x = F.pad(x, [0, size[1] * stride - W, 0, size[0] * stride - H], mode="replicate")
+    blocks = x.unfold(2, stride, stride).unfold(3, stride, stride)
+    blocks = blocks.reshape(*blocks.shape[:4], -1)
+    return blocks.mode(-1).values.squeeze(1).to(masks.dtype)
+
+
+_CORNER_SIGNS = torch.tensor([[-1, -1], [1, -1], [1, 1], [-1, 1]])
+"""Directions of top-left, top-right, bottom-right and bottom-left corners"""
+
+
+class BatchSegmentationAugment(v2.Transform):
+    """Same augmentations as :class:`SegmentationAugment`, but random parameters are
+    sampled for each sample in the batch and applied in one vectorized pass
+
+    Flips, perspective and rotation are combined into one homography for each sample
+    and applied by :func:`grid_sample`, so points moved outside the image by an
+    intermediate step are not filled. Masks are warped by the same grid with nearest
+    interpolation. The rescale is sampled per batch, since the output of a batch must
+    have the same size.
+
+    Expect images of float Tensor (B, C, H, W) and masks of int Tensor (B, H, W)
+    """
+
+    def __init__(
+        self,
+        hflip=0.0,
+        vflip=0.0,
+        blur_size=1,
+        blur_sigma: Sequence[float] = (0.1, 2.0),
+        color_jitter: Sequence[float] = (0, 0, 0, 0),
+        perspective=0.0,
+        rotation_range: Sequence[float] = (0, 0),
+        scale_range: Sequence[float] = (1, 1),
+        auto_contrast=0.0,
+        mask_fill=255,
+    ) -> None:
+        """See :class:`SegmentationAugment` for arguments"""
+        super().__init__()
+        self.hflip = hflip
+        self.vflip = vflip
+        self.blur_size = blur_size
+        self.blur_sigma = blur_sigma
+        jitter = list(color_jitter) + [0] * (4 - len(color_jitter))
+        self.brightness, self.contrast, self.saturation, self.hue = jitter
+        self.perspective = perspective
+        self.rotation_range = rotation_range
+        self.rescale = RandomRescale(scale_range)
+        self.auto_contrast = auto_contrast
+        self.mask_fill = mask_fill
+
+    def forward(
+        self, images: Tensor, masks: Tensor | None = None
+    ) -> tuple[Tensor, Tensor | None]:
+        inputs = images
+        images, masks = self._warp(images, masks)
+        images = self._blur(images)
+        images = self._jitter(images)
+        images = self.rescale(images)
+        images = self._autocontrast(images)
+        images = TF.normalize(images, IMAGENET_MEAN, IMAGENET_STDDEV)
+        return restore_memory_format(images, inputs), masks
+
+    def _rand(self, batch_size: int, low: float, high: float, device) -> Tensor:
+        """Sample on cpu so that results only depend on the global seed"""
+        return (torch.rand(batch_size) * (high - low) + low).to(device)
+
+    def _warp(self, images: Tensor, masks: Tensor | None):
+        has_rotation = self.rotation_range[0] != 0 or self.rotation_range[1] != 0
+        if self.hflip == 0 and self.vflip == 0 and self.perspective == 0:
+            if not has_rotation:
+                return images, masks
+
+        # all matrices map output pixels to input pixels, relative to image center
+        B, _, H, W = images.shape
+        device = images.device
+        matrix = torch.eye(3, device=device).repeat(B, 1, 1)
+        hflips = self._rand(B, 0, 1, device) < self.hflip
+        vflips = self._rand(B, 0, 1, device) < self.vflip
+        matrix[:, 0, 0] = torch.where(hflips, -1.0, 1.0)
+        matrix[:, 1, 1] = torch.where(vflips, -1.0, 1.0)
+
+        if self.perspective > 0:
+            corners = _CORNER_SIGNS * torch.tensor([W / 2, H / 2])
+            end_corners = self._sample_corners(B, H, W)
+            perspective = _homography(end_corners, corners.expand(B, 4, 2))
+            matrix = matrix @ perspective.to(device)
+
+        if has_rotation:
+            # positive angle rotates image counter-clockwise
+            angles = self._rand(B, *self.rotation_range, device).deg2rad()
+            cos, sin = angles.cos(), angles.sin()
+            rotation = torch.eye(3, device=device).repeat(B, 1, 1)
+            rotation[:, 0, 0], rotation[:, 0, 1] = cos, -sin
+            rotation[:, 1, 0], rotation[:, 1, 1] = sin, cos
+            matrix = matrix @ rotation
+
+        ys = torch.arange(H, device=device) + 0.5 - H / 2
+        xs = torch.arange(W, device=device) + 0.5 - W / 2
+        grid_y, grid_x = torch.meshgrid(ys, xs, indexing="ij")
+        points = torch.stack([grid_x, grid_y, torch.ones_like(grid_x)], -1)
+        sources = torch.einsum("bij,hwj->bhwi", matrix, points)
+        grid = sources[..., :2] / sources[..., 2:]
+        grid = grid / torch.tensor([W / 2, H / 2], device=device)
+        grid = grid.to(images.dtype)
+
+        images = F.grid_sample(images, grid, "bilinear", align_corners=False)
+        if masks is None:
+            return images, masks
+        # sample the mask together with the valid region to find the fill area
+        mask_input = torch.stack([masks.float(), torch.ones_like(masks.float())], 1)
+        warped = F.grid_sample(mask_input, grid, "nearest", align_corners=False)
+        warped_masks = warped[:, 0].round().to(masks.dtype)
+        masks = torch.where(warped[:, 1] > 0, warped_masks, self.mask_fill)
+        return images, masks
+
+    def _sample_corners(self, batch_size: int, height: int, width: int) -> Tensor:
+        """Return the corners (B, 4, 2) that the image corners are moved to, relative
+        to image center. Follow the sampling of :class:`v2.RandomPerspective`"""
+        dh = int(self.perspective * (height // 2))
+        dw = int(self.perspective * (width // 2))
+        corners = _CORNER_SIGNS * torch.tensor([width / 2, height / 2])
+        offsets = torch.stack(
+            [
+                torch.randint(0, dw + 1, [batch_size, 4]),
+                torch.randint(0, dh + 1, [batch_size, 4]),
+            ],
+            2,
+        )
+        end_corners = corners - _CORNER_SIGNS * offsets
+        apply = torch.rand(batch_size) < 0.5
+        return torch.where(apply[:, None, None], end_corners, corners)
+
+    def _blur(self, images: Tensor) -> Tensor:
+        if self.blur_size <= 1:
+            return images
+        B, C, H, W = images.shape
+        sigmas = self._rand(B, *self.blur_sigma, images.device)
+        half = (self.blur_size - 1) / 2
+        x = torch.linspace(-half, half, self.blur_size, device=images.device)
+        kernels = torch.exp(-0.5 * (x / sigmas[:, None]) ** 2)
+        kernels = kernels / kernels.sum(1, keepdim=True)
+        kernels = kernels.repeat_interleave(C, 0).to(images.dtype)
+
+        # separable convolution with one group for each channel of each sample
+        padding = self.blur_size // 2
+        x = images.reshape(1, B * C, H, W)
+        x = F.pad(x, [padding, padding, padding, padding], mode="reflect")
+        x = F.conv2d(x, kernels[:, None, None, :], groups=B * C)
+        x = F.conv2d(x, kernels[:, None, :, None], groups=B * C)
+        return x.reshape(B, C, H, W)
+
+    def _jitter(self, images: Tensor) -> Tensor:
+        B = images.size(0)
+        device = images.device
+
+        def factors(amount: float) -> Tensor:
+            values = self._rand(B, max(0, 1 - amount), 1 + amount, device)
+            return values.view(-1, 1, 1, 1)
+
+        # same as :class:`v2.ColorJitter`, the order is random for each call
+        for i in torch.randperm(4).tolist():
+            if i == 0 and self.brightness > 0:
+                images = (images * factors(self.brightness)).clamp(0, 1)
+            elif i == 1 and self.contrast > 0:
+                means = _grayscale(images).mean([-3, -2, -1], keepdim=True)
+                images = _blend(images, means, factors(self.contrast))
+            elif i == 2 and self.saturation > 0:
+                images = _blend(images, _grayscale(images), factors(self.saturation))
+            elif i == 3 and self.hue > 0:
+                shifts = self._rand(B, -self.hue, self.hue, device).view(-1, 1, 1)
+                hsv = _rgb_to_hsv(images)
+                hue = (hsv[:, 0] + shifts) % 1.0
+                images = _hsv_to_rgb(torch.stack([hue, hsv[:, 1], hsv[:, 2]], 1))
+        return images
+
+    def _autocontrast(self, images: Tensor) -> Tensor:
+        if self.auto_contrast == 0:
+            return images
+        apply = self._rand(images.size(0), 0, 1, images.device) < self.auto_contrast
+        minimum = images.amin([-2, -1], keepdim=True)
+        maximum = images.amax([-2, -1], keepdim=True)
+        equal = maximum == minimum
+        scale = torch.where(equal, 1.0, 1.0 / (maximum - minimum))
+        minimum = torch.where(equal, 0.0, minimum)
+        contrasted = ((images - minimum) * scale).clamp(0, 1)
+        return torch.where(apply[:, None, None, None], contrasted, images)
+
+
+def _homography(sources: Tensor, targets: Tensor) -> Tensor:
+    """Solve batch of homography matrices (B, 3, 3) mapping each source point
+    (B, 4, 2) to target point (B, 4, 2)
+    """
+    x, y = sources[..., 0], sources[..., 1]
+    u, v = targets[..., 0], targets[..., 1]
+    zeros, ones = torch.zeros_like(x), torch.ones_like(x)
+    rows_u = torch.stack([x, y, ones, zeros, zeros, zeros, -x * u, -y * u], -1)
+    rows_v = torch.stack([zeros, zeros, zeros, x, y, ones, -x * v, -y * v], -1)
+    a = torch.cat([rows_u, rows_v], 1).double()
+    b = torch.cat([u, v], 1).double()
+    coeffs = torch.linalg.solve(a, b).float()
+    coeffs = torch.cat([coeffs, torch.ones_like(coeffs[:, :1])], 1)
+    return coeffs.reshape(-1, 3, 3)
+
+
+def _grayscale(images: Tensor) -> Tensor:
+    r, g, b = images.unbind(-3)
+    return (0.2989 * r + 0.587 * g + 0.114 * b).unsqueeze(-3)
+
+
+def _blend(images: Tensor, others: Tensor, factors: Tensor) -> Tensor:
+    return (factors * images + (1 - factors) * others).clamp(0, 1)
+
+
+def _rgb_to_hsv(images: Tensor) -> Tensor:
+    r, g, b = images.unbind(-3)
+    maximum, minimum = images.amax(-3), images.amin(-3)
+    delta = maximum - minimum
+    safe_delta = torch.where(delta > 0, delta, 1.0)
+    hue = torch.where(
+        maximum == r,
+        ((g - b) / safe_delta) % 6,
+        torch.where(maximum == g, (b - r) / safe_delta + 2, (r - g) / safe_delta + 4),
+    )
+    hue = torch.where(delta > 0, hue / 6, 0.0)
+    saturation = delta / torch.where(maximum > 0, maximum, 1.0)
+    return torch.stack([hue, saturation, maximum], -3)
+
+
+def _hsv_to_rgb(images: Tensor) -> Tensor:
+    hue, saturation, value = images.unbind(-3)
+    channels = []
+    for n in (5, 3, 1):
+        k = (n + hue * 6) % 6
+        weight = torch.minimum(k, 4 - k).clamp(0, 1)
+        channels.append(value - value * saturation * weight)
+    return torch.stack(channels, -3)
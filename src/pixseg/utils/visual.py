@@ -48,6 +48,33 @@ def draw_mask_on_image(
     return overlay
 
 
+def overlay_masks(
+    images: Tensor,
+    masks: Tensor,
+    colors: Sequence[tuple[int, int, int]],
+    extra_color: tuple[int, int, int] | None = None,
+    alpha: float = 0.8,
+) -> Tensor:
+    """Same as :func:`draw_mask_on_image` but colorize by looking up a palette, which
+    also works on batches and does not grow with the number of classes
+
+    Args:
+        images: float Tensor of shape (..., 3, H, W) in range [0, 1]
+        masks: int Tensor of shape (..., H, W)
+    """
+    num_classes = len(colors)
+    palette = torch.tensor(
+        [*colors, extra_color or (0, 0, 0)], dtype=images.dtype, device=images.device
+    )
+    palette /= 255
+    in_range = (masks >= 0) & (masks < num_classes)
+    color_map = palette[torch.where(in_range, masks, num_classes)].movedim(-1, -3)
+    overlay = images * (1 - alpha) + color_map * alpha
+    if extra_color is not None:
+        return overlay
+    return torch.where(in_range.unsqueeze(-3), overlay, images)
+
+
 def combine_images(images: list[Tensor], **kwargs) -> Tensor:
     """Combine images of different sizes into grid
 
@@ -105,6 +132,37 @@ def plot_confusion_matrix(
     plt.tight_layout()
 
 
+def plot_reliability_diagram(
+    confidences: np.ndarray, accuracies: np.ndarray, axes: Axes | None = None
+):
+    """Plot accuracy against confidence of each equal-width bin
+
+    See :meth:`CalibrationStore.reliability` for the inputs
+    """
+    if axes is None:
+        axes = plt.gca()
+    num_bins = len(confidences)
+    bin_centers = (np.arange(num_bins) + 0.5) / num_bins
+    axes.bar(bin_centers, np.nan_to_num(accuracies), width=1 / num_bins, label="Output")
+    axes.bar(
+        bin_centers,
+        np.nan_to_num(confidences - accuracies),
+        bottom=np.nan_to_num(accuracies),
+        width=1 / num_bins,
+        alpha=0.5,
+        label="Gap",
+    )
+    axes.plot([0, 1], [0, 1], linestyle="--", color="gray")
+    axes.set_xlim(0, 1)
+    axes.set_ylim(0, 1)
+    axes.legend()
+
+    plt.ylabel("Accuracy")
+    plt.xlabel("Confidence")
+    plt.title("Reliability diagram")
+    plt.tight_layout()
+
+
 def plot_running_metrics(
     job_metrics: dict[str, dict[str, list[float]]], figure: Figure | None = None
 ):
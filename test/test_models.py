@@ -8,6 +8,7 @@ from torch import Tensor, nn
 
 sys.path.append(str((Path(__file__) / "../..").resolve()))
 from src.pixseg.models import *
+from src.pixseg.pipeline.config import safe_transfer_state_dict
 
 
 def test_registry():
@@ -47,6 +48,58 @@ def test_weights(model_name: str, weights_enum: type[SegWeightsEnum]):
         MODEL_ZOO[model_name](weights=w.value)
 
 
+@pytest.mark.parametrize(
+    "model_builder", [upernet_resnet18, sfnet_resnet18, bisenet_xception]
+)
+def test_activation_checkpointing(model_builder: Callable[..., nn.Module]):
+    fake_input = torch.rand([2, 3, 64, 64])
+    outputs: list[Tensor] = []
+    grads: list[Tensor] = []
+    states: list[dict[str, Tensor]] = []
+    for enabled in (False, True):
+        torch.manual_seed(0)
+        model = model_builder(weights_backbone=None)
+        assert set_activation_checkpointing(model, enabled=enabled) > 0
+        out = model(fake_input)["out"]
+        out.sum().backward()
+        outputs.append(out)
+        grads.append(next(model.parameters()).grad)  # type: ignore
+        states.append(model.state_dict())
+
+    assert torch.allclose(outputs[0], outputs[1], atol=1e-5)
+    assert torch.allclose(grads[0], grads[1], atol=1e-4)
+    for k, v in states[0].items():
+        assert torch.allclose(v.float(), states[1][k].float(), atol=1e-5), k
+
+
+def test_build_from_state_dict():
+    torch.manual_seed(0)
+    source = upernet_resnet18(num_classes=3, weights_backbone=None)
+    state_dict = source.state_dict()
+    model = build_from_state_dict(upernet_resnet18, state_dict, num_classes=3)
+    assert model is not None
+    for k, v in model.state_dict().items():
+        assert v.data_ptr() == state_dict[k].data_ptr(), k  # assigned without copy
+    assert all(p.requires_grad for p in model.parameters())
+    fake_input = torch.rand([2, 3, 64, 64])
+    source.eval()
+    model.eval()
+    assert torch.equal(source(fake_input)["out"], model(fake_input)["out"])
+
+    mismatched = build_from_state_dict(upernet_resnet18, state_dict, num_classes=5)
+    assert mismatched is None
+    half_state = {
+        k: v.half() if v.is_floating_point() else v for k, v in state_dict.items()
+    }
+    assert build_from_state_dict(upernet_resnet18, half_state, num_classes=3) is None
+    # the fallback casts to the dtype of the model
+    fallback = upernet_resnet18(num_classes=3, weights_backbone=None)
+    safe_transfer_state_dict(fallback, half_state)
+    for k, v in fallback.state_dict().items():
+        assert v.dtype == state_dict[k].dtype, k
+        assert torch.equal(v, half_state[k].to(v.dtype)), k
+
+
 def _main():
     from pprint import pprint
 
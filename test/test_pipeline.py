@@ -1,18 +1,55 @@
 """Since pipeline integrates different components, this is pretty much an integration test."""
 
+import copy
+import io
 import shutil
 import sys
+import threading
 import warnings
 from pathlib import Path
+from typing import Any
 
+import numpy as np
+import pytest
 import toml
 import torch
-from torch.utils.data import Dataset
+import tqdm
+from torch import GradScaler
+from torch.utils.data import DataLoader, Dataset, TensorDataset
 
 sys.path.append(str((Path(__file__) / "../..").resolve()))
 from src.pixseg.datasets import register_dataset
-from src.pixseg.pipeline import Config
-from src.pixseg.utils.rng import seed
+from src.pixseg.learn import DiceLoss
+from src.pixseg.pipeline import Config, forward_batch, upsample_argmax
+from src.pixseg.pipeline.checkpoint_writer import (
+    CheckpointWriter,
+    resolve_model_path,
+)
+from src.pixseg.pipeline.compile import (
+    GRAPH_BREAKS,
+    compile_module,
+    explain_graph_breaks,
+)
+from src.pixseg.pipeline.distributed import (
+    ResumableDistributedSampler,
+    get_rank,
+    init_distributed,
+    launch,
+    unwrap_model,
+    wrap_model,
+)
+from src.pixseg.pipeline.engine import (
+    ProgressReporter,
+    eval_one_epoch,
+    needs_grad_scaler,
+    train_one_epoch,
+)
+from src.pixseg.pipeline.prefetch import Prefetcher
+from src.pixseg.pipeline.profiling import create_profiler
+from src.pixseg.pipeline.timing import StepTimer, split_times
+from src.pixseg.pipeline.trainer import Trainer
+from src.pixseg.utils.metrics import MetricStore
+from src.pixseg.utils.rng import rng_state_dict, seed
 
 NUM_FAKE_CLASSES = 10
 
@@ -40,6 +77,23 @@ class _FakeDataset(Dataset):
         return image, mask
 
 
+class _DictOutput(torch.nn.Sequential):
+    """Return the output of the layers as logits of each key in :attr:`output_keys`,
+    like the models"""
+
+    output_keys = ("out",)
+
+    def forward(self, x):
+        out = super().forward(x)
+        return {k: out for k in self.output_keys}
+
+
+def _conv_model(**kwargs) -> _DictOutput:
+    """1x1 conv to the fake classes by default"""
+    kwargs.setdefault("kernel_size", 1)
+    return _DictOutput(torch.nn.Conv2d(3, NUM_FAKE_CLASSES, **kwargs))
+
+
 def test_config_trainer(path=r"doc\sample_config.toml"):
     config_dict = toml.load(path)
     config_dict["data"]["dataset"]["dataset"] = "_FakeDataset"
@@ -58,6 +112,575 @@ def test_config_trainer(path=r"doc\sample_config.toml"):
         )
 
 
+def test_config_trainer_steps(path=r"doc\sample_config.toml"):
+    config_dict = toml.load(path)
+    config_dict["data"]["dataset"]["dataset"] = "_FakeDataset"
+    config_dict["data"]["dataset"]["params"] = {}
+    config_dict["optimizer"]["effective_batch_size"] = 4
+    # 5 iterations in each epoch
+    config_dict["trainer"]["params"] |= {
+        "max_steps": 7,
+        "val_every_n_steps": 3,
+        "subset_val_every_n_steps": 2,
+        "subset_val_size": 2,
+    }
+    config = Config(config_dict)
+    trainer = config.to_trainer()
+    trainer.train()
+
+    assert trainer.global_step == 7
+    # validate at 3, 6 and the end, and subset at 2 and 4
+    val_metrics = trainer.job_metrics[trainer.VAL]
+    assert len(next(iter(val_metrics.values()))) == 3
+    subset_metrics = trainer.job_metrics[trainer.VAL_SUBSET]
+    assert len(next(iter(subset_metrics.values()))) == 2
+    shutil.rmtree(config.out_folder)
+
+
+def test_upsample_argmax():
+    logits = torch.randn([2, NUM_FAKE_CLASSES, 12, 16])
+    size = (48, 64)
+    full_logits = torch.nn.functional.interpolate(logits, size, mode="bilinear")
+    preds, probs = upsample_argmax(logits, size, 3 * 48 * 64, return_prob=True)
+    assert torch.equal(preds, full_logits.argmax(1))
+    assert probs is not None
+    assert torch.allclose(probs, full_logits.softmax(1).amax(1), atol=1e-6)
+
+
+def test_forward_batch_padding():
+    model = _conv_model()
+    images = torch.rand([2, 3, 30, 45])
+    logits, _ = forward_batch(model, images, None, None, None, "cpu")
+    padded, _ = forward_batch(
+        model, images, None, None, None, "cpu", pad_to_multiple=32
+    )
+    assert padded["out"].shape == logits["out"].shape
+    assert torch.allclose(padded["out"], logits["out"], atol=1e-6)
+
+
+def test_forward_batch_precision():
+    images = torch.rand([2, 3, 16, 24])
+    masks = torch.randint(0, NUM_FAKE_CLASSES, [2, 16, 24])
+    logits, losses = forward_batch(
+        _conv_model(),
+        images,
+        masks,
+        None,
+        DiceLoss(),
+        "cpu",
+        precision="bf16",
+    )
+    assert logits["out"].dtype == torch.bfloat16
+    assert losses["out"].dtype == torch.float32
+    assert not needs_grad_scaler("cpu", "bf16")
+    assert needs_grad_scaler("cpu", "fp16")
+
+
+def test_forward_batch_upsample_keys():
+    model = _conv_model(kernel_size=4, stride=4)
+    model.output_keys = ("out", "aux")
+    images = torch.rand([2, 3, 32, 48])
+    masks = torch.randint(0, NUM_FAKE_CLASSES, [2, 32, 48])
+    criterion = torch.nn.CrossEntropyLoss()
+    logits, losses = forward_batch(
+        model,
+        images,
+        masks,
+        None,
+        criterion,
+        "cpu",
+        loss_stride={"aux": 4},
+        upsample=["out"],
+    )
+    assert logits["out"].shape[-2:] == (32, 48)
+    assert logits["aux"].shape[-2:] == (8, 12)
+    assert set(losses.keys()) == {"out", "aux"}
+
+
+def test_eval_one_epoch_budget(monkeypatch: pytest.MonkeyPatch):
+    images = torch.rand([4, 3, 32, 32])
+    masks = torch.randint(0, NUM_FAKE_CLASSES, [4, 32, 32])
+    loader = DataLoader(TensorDataset(images, masks), batch_size=2)
+    model = _conv_model(kernel_size=8, stride=8)
+    budget = 2 * 32 * 32
+
+    interpolate = torch.nn.functional.interpolate
+    sizes: list[int] = []
+
+    def _interpolate(*args, **kwargs):
+        output = interpolate(*args, **kwargs)
+        sizes.append(output.numel())
+        return output
+
+    monkeypatch.setattr(torch.nn.functional, "interpolate", _interpolate)
+    ms = eval_one_epoch(
+        model,
+        loader,
+        None,  # type: ignore
+        torch.nn.CrossEntropyLoss(),
+        "cpu",
+        NUM_FAKE_CLASSES,
+        silent=True,
+        upsample_budget=budget,
+    )
+    assert len(sizes) > 0
+    assert max(sizes) <= budget
+    assert ms.count_data == 4
+    assert ms.confusion_matrix.sum() == 4 * 32 * 32
+
+
+class _ItemModel(_DictOutput):
+    def forward(self, x):
+        scale = x.mean().item()  # graph break
+        return {"out": super().forward(x)["out"] * scale}
+
+
+def test_explain_graph_breaks():
+    images = torch.rand([1, 3, 16, 16])
+    reasons = explain_graph_breaks("item", _ItemModel(torch.nn.Conv2d(3, 4, 1)), images)
+    assert len(reasons) > 0
+    assert GRAPH_BREAKS["item"] == reasons
+
+    suppress_errors = torch._dynamo.config.suppress_errors
+    model = _ItemModel(torch.nn.Conv2d(3, 4, 1))
+    expected = model(images)["out"]
+    compile_module(model, explain_inputs=[images], backend="eager")
+    assert len(GRAPH_BREAKS["_ItemModel"]) > 0
+    assert set(model.state_dict().keys()) == {"0.weight", "0.bias"}
+    assert model.training
+    assert torch.allclose(model(images)["out"], expected)
+    assert torch._dynamo.config.suppress_errors == suppress_errors
+    torch._dynamo.reset()
+
+
+def test_eval_one_epoch_augmented_masks():
+    def _zero_masks(images, masks):
+        return images, torch.zeros_like(masks)
+
+    images = torch.rand([4, 3, 8, 8])
+    masks = torch.randint(1, NUM_FAKE_CLASSES, [4, 8, 8])
+    loader = DataLoader(TensorDataset(images, masks), batch_size=2)
+    model = _conv_model()
+    with torch.no_grad():
+        model[0].weight.zero_()
+        model[0].bias.zero_()
+        model[0].bias[0] = 1.0
+    ms = eval_one_epoch(
+        model,
+        loader,
+        _zero_masks,  # type: ignore
+        torch.nn.CrossEntropyLoss(),
+        "cpu",
+        NUM_FAKE_CLASSES,
+        silent=True,
+    )
+    # scored against the augmented masks from forward_batch
+    assert ms.confusion_matrix[0, 0] == 4 * 8 * 8
+
+
+def test_eval_one_epoch_per_image():
+    images = torch.rand([6, 3, 8, 8])
+    masks = torch.randint(0, NUM_FAKE_CLASSES, [6, 8, 8])
+    loader = DataLoader(TensorDataset(images, masks), batch_size=4)
+    ms = eval_one_epoch(
+        _conv_model(),
+        loader,
+        None,  # type: ignore
+        torch.nn.CrossEntropyLoss(),
+        "cpu",
+        NUM_FAKE_CLASSES,
+        silent=True,
+        per_image=True,
+        worst_k=2,
+    )
+    assert ms.image_records.shape == (6, 3, NUM_FAKE_CLASSES)
+    assert len(ms.worst_images()) == 2
+
+
+def test_step_timer():
+    timer = StepTimer("cpu")
+    images = torch.rand([2, 3, 30, 45])
+    masks = torch.randint(0, NUM_FAKE_CLASSES, [2, 30, 45])
+    criterion = torch.nn.CrossEntropyLoss()
+    forward_batch(_conv_model(), images, masks, None, criterion, "cpu", timer=timer)
+    timer.add("data", 1.0)
+    metrics, times = split_times({"miou": 0.5} | timer.pop_times())
+    assert metrics == {"miou": 0.5}
+    assert set(times.keys()) == {"h2d", "forward", "loss", "data"}
+    assert times["data"] == 1.0
+    assert len(timer.pop_times()) == 0
+
+
+def test_create_profiler(tmp_path: Path):
+    saved: list[tuple[Path, Path]] = []
+    profiler = create_profiler(
+        tmp_path,
+        "train",
+        "cpu",
+        wait=1,
+        warmup=1,
+        active=2,
+        callback=lambda *files: saved.append(files),
+    )
+    with profiler:
+        for _ in range(6):
+            torch.rand([64, 64]) @ torch.rand([64, 64])
+            profiler.step()
+    assert len(saved) == 1
+    trace_file, summary_file = saved[0]
+    assert trace_file.is_file() and summary_file.is_file()
+
+
+def test_checkpoint_writer(tmp_path: Path):
+    saved: list[Path] = []
+    writer = CheckpointWriter(lambda m, c: saved.append(c))
+    weight = torch.rand([4, 4])
+    folders = [tmp_path / "step", tmp_path / "latest"]
+    writer.save({"weight": weight}, {"job_metrics": {}}, folders)
+    weight.zero_()  # states are copied when saving
+    writer.save({"weight": weight}, {"job_metrics": {}}, [tmp_path / "next"], folders)
+    writer.close()
+
+    assert saved == [f / "checkpoint.pth" for f in folders + [tmp_path / "next"]]
+    assert not any(f.exists() for f in folders)
+    checkpoint_file = tmp_path / "next" / "checkpoint.pth"
+    checkpoint = torch.load(checkpoint_file, weights_only=True)
+    model_path = resolve_model_path(checkpoint_file, checkpoint["model_path"])
+    model_state = torch.load(model_path, weights_only=True)
+    assert torch.equal(model_state["weight"], weight)
+
+
+def test_resumable_distributed_sampler():
+    dataset = range(25)
+    shards = [ResumableDistributedSampler(dataset, 2, r, seed=3) for r in range(2)]
+    for sampler in shards:
+        sampler.set_epoch(1)
+    full = [list(sampler) for sampler in shards]
+    assert sorted(set(full[0] + full[1])) == list(dataset)
+
+    resumed = ResumableDistributedSampler(dataset, 2, 1, seed=3)
+    resumed.load_state_dict({"epoch": 1, "start_index": 5})
+    assert len(resumed) == len(full[1]) - 5
+    assert list(resumed) == full[1][5:]
+
+
+def test_progress_reporter():
+    ms = MetricStore(NUM_FAKE_CLASSES)
+    loader = tqdm.tqdm(range(7), file=io.StringIO())
+    progress = ProgressReporter(loader, ms, refresh_seconds=None, refresh_steps=3)
+    shown: list[float | None] = []
+    for i in loader:
+        ms.store_measures(1, {"loss": float(i)})
+        progress.step()
+        shown.append(progress.summary.get("loss"))
+    # refreshed after step 3 and 6 with the average so far
+    assert shown == [None, None, 1.0, 1.0, 1.0, 2.5, 2.5]
+    progress.refresh()
+    assert progress.summary["loss"] == 3.0
+    assert "loss=3" in str(loader.postfix)
+    loader.close()
+
+
+class _FailingDataset(Dataset):
+    def __len__(self):
+        return 8
+
+    def __getitem__(self, index):
+        if index == 5:
+            raise ValueError("broken item")
+        return torch.full([3, 4, 4], float(index)), torch.zeros([4, 4])
+
+
+def _prefetch_loader(dataset: Dataset) -> DataLoader:
+    # data loaded in workers, so batches are moved in a background thread on cpu
+    return DataLoader(dataset, batch_size=2, num_workers=2)
+
+
+def test_prefetcher_thread_order():
+    images = torch.rand([10, 3, 4, 4])
+    masks = torch.randint(0, NUM_FAKE_CLASSES, [10, 4, 4])
+    loader = _prefetch_loader(TensorDataset(images, masks))
+    expected = list(loader)
+    prefetched = list(Prefetcher(loader, "cpu", num_prefetch=1))
+    assert len(prefetched) == len(expected)
+    for (image, mask), (expected_image, expected_mask) in zip(prefetched, expected):
+        assert torch.equal(image, expected_image)
+        assert torch.equal(mask, expected_mask)  # type: ignore
+
+
+def test_prefetcher_stop_early():
+    images = torch.rand([40, 3, 4, 4])
+    loader = _prefetch_loader(TensorDataset(images, torch.zeros([40, 4, 4])))
+    batches = iter(Prefetcher(loader, "cpu", num_prefetch=1))
+    next(batches)
+    batches.close()  # same as breaking out of the loop
+    # default thread name contains the target
+    assert not any("produce" in t.name for t in threading.enumerate())
+
+
+def test_prefetcher_errors():
+    loader = _prefetch_loader(_FailingDataset())
+    with pytest.raises(ValueError, match="broken item"):
+        list(Prefetcher(loader, "cpu"))
+
+    def failing_augment(images, masks):
+        raise RuntimeError("broken augment")
+
+    images, masks = torch.rand([4, 3, 4, 4]), torch.zeros([4, 4, 4])
+    loader = _prefetch_loader(TensorDataset(images, masks))
+    with pytest.raises(RuntimeError, match="broken augment"):
+        list(Prefetcher(loader, "cpu", failing_augment))  # type: ignore
+
+
+def _squeeze_mask(image: torch.Tensor, mask: torch.Tensor):
+    return image, mask[0]
+
+
+def _ddp_datasets() -> tuple[Dataset, Dataset]:
+    return _FakeDataset(_squeeze_mask, 8, 8, 8), _FakeDataset(_squeeze_mask, 6, 8, 8)
+
+
+def _ddp_train(model: torch.nn.Module, loader: DataLoader):
+    train_one_epoch(
+        model,
+        loader,
+        None,  # type: ignore
+        torch.nn.CrossEntropyLoss(),
+        torch.optim.SGD(model.parameters(), lr=0.1),
+        GradScaler("cpu", enabled=False),
+        "cpu",
+        1,
+        NUM_FAKE_CLASSES,
+        {},
+        silent=True,
+    )
+
+
+def _ddp_eval(model: torch.nn.Module, loader: DataLoader) -> MetricStore:
+    return eval_one_epoch(
+        model,
+        loader,
+        None,  # type: ignore
+        torch.nn.CrossEntropyLoss(),
+        "cpu",
+        NUM_FAKE_CLASSES,
+        silent=True,
+    )
+
+
+def _ddp_worker(out_folder: Path):
+    init_distributed("cpu")
+    torch.manual_seed(0)
+    model = wrap_model(_conv_model(kernel_size=3, padding=1), "cpu")
+    # each step of 2 replicas covers the same 4 samples as a batch of single process
+    train_set, val_set = _ddp_datasets()
+    train_sampler = ResumableDistributedSampler(train_set, shuffle=False)
+    val_sampler = ResumableDistributedSampler(val_set, shuffle=False)
+    _ddp_train(model, DataLoader(train_set, batch_size=2, sampler=train_sampler))
+    ms = _ddp_eval(model, DataLoader(val_set, batch_size=1, sampler=val_sampler))
+    ms.all_reduce()
+    result = {
+        "params": unwrap_model(model).state_dict(),
+        "cm": torch.from_numpy(ms.confusion_matrix),
+        "count_data": ms.count_data,
+        "loss": ms.measures["loss"],
+    }
+    torch.save(result, out_folder / f"rank{get_rank()}.pth")
+
+
+def test_distributed_training(tmp_path: Path, free_port: int):
+    launch(_ddp_worker, 2, tmp_path, master_port=free_port)
+    results = [torch.load(tmp_path / f"rank{r}.pth", weights_only=True) for r in (0, 1)]
+    params = results[0]["params"]
+    for k, v in results[1]["params"].items():
+        assert torch.equal(params[k], v), k
+
+    train_set, val_set = _ddp_datasets()
+    torch.manual_seed(0)
+    model = _conv_model(kernel_size=3, padding=1)
+    _ddp_train(model, DataLoader(train_set, batch_size=4))
+    for k, v in model.state_dict().items():
+        assert torch.allclose(params[k], v, atol=1e-6), k
+
+    model.load_state_dict(params)
+    ms = _ddp_eval(model, DataLoader(val_set, batch_size=2))
+    for result in results:
+        assert np.array_equal(result["cm"].numpy(), ms.confusion_matrix)
+        assert result["count_data"] == ms.count_data
+        assert result["loss"] == pytest.approx(ms.measures["loss"])
+
+
+def _tensor_dataset(num_samples: int) -> TensorDataset:
+    """Fixed data, so loading leaves the global random state alone unlike
+    :class:`_FakeDataset`"""
+    generator = torch.Generator().manual_seed(num_samples)
+    images = torch.rand([num_samples, 3, 8, 8], generator=generator)
+    masks = torch.randint(0, NUM_FAKE_CLASSES, [num_samples, 8, 8], generator=generator)
+    return TensorDataset(images, masks)
+
+
+def test_train_one_epoch_resume():
+    dataset = _tensor_dataset(12)
+    sampler = ResumableDistributedSampler(dataset, 1, 0, seed=1)
+    loader = DataLoader(dataset, batch_size=2, sampler=sampler)
+    torch.manual_seed(0)
+    model = _DictOutput(torch.nn.Conv2d(3, NUM_FAKE_CLASSES, 1), torch.nn.Dropout(0.5))
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    kwargs = {
+        "augment": None,
+        "criterion": torch.nn.CrossEntropyLoss(),
+        "scaler": GradScaler("cpu", enabled=False),
+        "device": "cpu",
+        "learn_step": 2,
+        "num_classes": NUM_FAKE_CLASSES,
+        "loss_weight": {},
+        "silent": True,
+    }
+
+    saved = {}
+
+    def save_progress(iteration: int, ms: MetricStore):
+        if iteration == 2:
+            saved["model"] = copy.deepcopy(model.state_dict())
+            saved["optimizer"] = copy.deepcopy(optimizer.state_dict())
+            saved["metric"] = ms.state_dict()
+            saved["rng"] = rng_state_dict()
+
+    sampler.set_epoch(0)
+    full_ms = train_one_epoch(
+        model, loader, optimizer=optimizer, step_callback=save_progress, **kwargs
+    )
+    full_state = copy.deepcopy(model.state_dict())
+
+    model.load_state_dict(saved["model"])
+    optimizer.load_state_dict(saved["optimizer"])
+    sampler.set_epoch(0, start_index=2 * 2)
+    ms = MetricStore(NUM_FAKE_CLASSES, "cpu")
+    ms.load_state_dict(saved["metric"])
+    resumed_ms = train_one_epoch(
+        model,
+        loader,
+        optimizer=optimizer,
+        start_iteration=2,
+        metric_store=ms,
+        rng_state=saved["rng"],
+        **kwargs,
+    )
+    for k, v in full_state.items():
+        assert torch.equal(model.state_dict()[k], v), k
+    assert np.array_equal(resumed_ms.confusion_matrix, full_ms.confusion_matrix)
+    assert resumed_ms.count_data == full_ms.count_data
+    assert resumed_ms.measures["loss"] == full_ms.measures["loss"]
+
+
+def _resume_trainer(out_folder: Path | None = None) -> Trainer:
+    torch.manual_seed(0)
+    model = _DictOutput(torch.nn.Conv2d(3, NUM_FAKE_CLASSES, 1), torch.nn.Dropout(0.5))
+    train_set = _tensor_dataset(12)
+    sampler = ResumableDistributedSampler(train_set, 1, 0, seed=1)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    trainer = Trainer(
+        model=model,
+        train_loader=DataLoader(train_set, batch_size=2, sampler=sampler),
+        train_augment=None,  # type: ignore
+        val_loader=DataLoader(_tensor_dataset(4), batch_size=2),
+        val_augment=None,  # type: ignore
+        criterion=torch.nn.CrossEntropyLoss(),
+        optimizer=optimizer,
+        lr_scheduler=torch.optim.lr_scheduler.StepLR(optimizer, 1),
+        scaler=GradScaler("cpu", enabled=False),
+        device="cpu",
+        learn_step=1,
+        num_epochs=1,
+        num_classes=NUM_FAKE_CLASSES,
+        loss_weight={},
+        labels=[str(i) for i in range(NUM_FAKE_CLASSES)],
+        colors=[(i, i, i) for i in range(NUM_FAKE_CLASSES)],
+        out_folder=out_folder,
+        checkpoint_every_n_steps=2,
+        async_checkpoint=False,
+    )
+    trainer.silent = True
+    return trainer
+
+
+class _Interrupted(Exception):
+    pass
+
+
+def _assert_same_results(state_dict: dict, expected: dict):
+    ms = MetricStore(NUM_FAKE_CLASSES)
+    ms.load_state_dict(state_dict)
+    expected_ms = MetricStore(NUM_FAKE_CLASSES)
+    expected_ms.load_state_dict(expected)
+    assert np.array_equal(ms.confusion_matrix, expected_ms.confusion_matrix)
+    assert ms.count_data == expected_ms.count_data
+    assert ms.measures["loss"] == expected_ms.measures["loss"]
+
+
+def test_trainer_resume_checkpoint(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    # uninterrupted run, recording the results at each progress
+    full = _resume_trainer()
+    full_progress: list[dict] = []
+
+    def record_progress(epoch: int, iteration: int, ms: MetricStore):
+        full_progress.append(copy.deepcopy(ms.state_dict()))
+
+    monkeypatch.setattr(full, "save_progress", record_progress)
+    full.train()
+
+    # stop right after the first progress is saved
+    interrupted = _resume_trainer(tmp_path)
+    save_progress = interrupted.save_progress
+
+    def save_and_stop(epoch: int, iteration: int, ms: MetricStore):
+        save_progress(epoch, iteration, ms)
+        raise _Interrupted()
+
+    monkeypatch.setattr(interrupted, "save_progress", save_and_stop)
+    with pytest.raises(_Interrupted):
+        interrupted.train()
+
+    checkpoint_file = tmp_path / "latest" / "checkpoint.pth"
+    checkpoint = torch.load(checkpoint_file, weights_only=True)
+    progress = checkpoint["progress"]
+    assert progress["epoch"] == 0
+    assert progress["iteration"] == 2
+    assert progress["sampler_state_dict"] == {"epoch": 0, "start_index": 4}
+    _assert_same_results(progress["metric_state_dict"], full_progress[0])
+
+    resumed = _resume_trainer()
+    torch.manual_seed(1)  # restored from checkpoint instead
+    resumed.load_checkpoint(checkpoint_file)
+    resume_epoch = resumed.resume_epoch
+    resumes: list[dict] = []
+
+    def record_resume(step: int) -> dict[str, Any]:
+        kwargs = resume_epoch(step)
+        resumes.append(
+            {
+                "start_iteration": kwargs["start_iteration"],
+                "start_index": resumed.train_loader.sampler.start_index,
+                "metric_state_dict": copy.deepcopy(kwargs["metric_store"].state_dict()),
+            }
+        )
+        return kwargs
+
+    monkeypatch.setattr(resumed, "resume_epoch", record_resume)
+    resumed.train()
+
+    assert len(resumes) == 1
+    assert resumes[0]["start_iteration"] == 2
+    assert resumes[0]["start_index"] == 4
+    _assert_same_results(resumes[0]["metric_state_dict"], full_progress[0])
+    for k, v in full.model.state_dict().items():
+        assert torch.equal(resumed.model.state_dict()[k], v), k
+    for job in (Trainer.TRAIN, Trainer.VAL):
+        for k, v in full.job_metrics[job].items():
+            if k != "time":  # wall time differs
+                assert resumed.job_metrics[job][k] == v, (job, k)
+
+
 def _main():
     import logging
 
@@ -0,0 +1,358 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+from torchvision.transforms.v2 import InterpolationMode
+from torchvision.transforms.v2 import functional as TF
+
+sys.path.append(str((Path(__file__) / "../..").resolve()))
+from src.pixseg.pipeline.distributed import get_rank, init_distributed, launch
+from src.pixseg.utils.metrics import (
+    BoundaryStore,
+    CalibrationStore,
+    MetricStore,
+    bootstrap_metrics,
+    fast_confusion_matrix,
+    fold_confusion_matrix,
+    label_boundary,
+    lut_from_groups,
+    records_miou,
+)
+from src.pixseg.utils.tensor_file import load_tensor_file, save_tensor_file
+from src.pixseg.utils.transform import (
+    IMAGENET_MEAN,
+    IMAGENET_STDDEV,
+    BatchSegmentationAugment,
+    SegmentationAugment,
+    downsample_mask,
+)
+from src.pixseg.utils.visual import draw_mask_on_image, overlay_masks
+
+NUM_CLASSES = 5
+
+
+def _fake_results(seed: int) -> tuple[torch.Tensor, torch.Tensor]:
+    torch.manual_seed(seed)
+    # include ignored values on both sides
+    truths = torch.randint(-1, NUM_CLASSES + 1, [2, 40, 30])
+    preds = torch.randint(0, NUM_CLASSES + 1, [2, 40, 30])
+    return truths, preds
+
+
+def test_fast_confusion_matrix():
+    truths, preds = _fake_results(0)
+    matrix = fast_confusion_matrix(truths, preds, NUM_CLASSES)
+    in_range = (truths >= 0) & (truths < NUM_CLASSES) & (preds < NUM_CLASSES)
+    assert matrix.shape == (NUM_CLASSES, NUM_CLASSES)
+    assert matrix.sum().item() == in_range.sum().item()
+    for i, j in [(0, 0), (1, 3), (4, 2)]:
+        expected = ((truths == i) & (preds == j)).sum().item()
+        assert matrix[i, j].item() == expected
+
+
+def test_metric_store_device():
+    host_ms = MetricStore(NUM_CLASSES)
+    device_ms = MetricStore(NUM_CLASSES, device="cpu")
+    for seed in range(3):
+        truths, preds = _fake_results(seed)
+        host_ms.store_results(truths, preds)
+        device_ms.store_results(truths, preds)
+        assert np.array_equal(host_ms.confusion_matrix, device_ms.confusion_matrix)
+    assert host_ms.summarize() == device_ms.summarize()
+
+
+def test_metric_store_merge():
+    full_ms = MetricStore(NUM_CLASSES)
+    shard_mss = [MetricStore(NUM_CLASSES), MetricStore(NUM_CLASSES, device="cpu")]
+    for seed in range(4):
+        truths, preds = _fake_results(seed)
+        measures = {"loss": float(seed)}
+        full_ms.store_results(truths, preds)
+        full_ms.store_measures(2, measures)
+        shard_mss[seed % 2].store_results(truths, preds)
+        shard_mss[seed % 2].store_measures(2, measures)
+
+    shard_mss[0].merge(shard_mss[1])
+    assert np.array_equal(full_ms.confusion_matrix, shard_mss[0].confusion_matrix)
+    assert full_ms.summarize() == shard_mss[0].summarize()
+
+
+def test_metric_store_per_image():
+    ms = MetricStore(NUM_CLASSES, per_image=True, worst_k=3)
+    for seed in range(3):
+        ms.store_results(*_fake_results(seed))
+
+    records = ms.image_records
+    assert records.shape == (6, 3, NUM_CLASSES)
+    assert np.array_equal(records[:, 0].sum(0), np.diag(ms.confusion_matrix))
+    ious = records_miou(records)
+    worst = ms.worst_images()
+    assert len(worst) == 3
+    assert [i for i, _ in worst] == np.argsort(ious, kind="stable")[:3].tolist()
+
+
+def test_metric_store_records_growth():
+    ms = MetricStore(NUM_CLASSES, per_image=True)
+    truths = torch.randint(0, NUM_CLASSES, [5000, 2, 2])
+    preds = torch.randint(0, NUM_CLASSES, [5000, 2, 2])
+    capacities: list[int] = []
+    for start in range(0, 5000, 100):
+        ms.store_results(truths[start : start + 100], preds[start : start + 100])
+        if len(ms._records) not in capacities:
+            capacities.append(len(ms._records))
+    assert ms.image_records.shape == (5000, 3, NUM_CLASSES)
+    assert np.array_equal(ms.image_records[:, 0].sum(0), np.diag(ms.confusion_matrix))
+    assert capacities == [1024, 2048, 4096, 8192]  # doubled, not by fixed chunks
+
+
+def test_metric_store_state_dict():
+    ms = MetricStore(NUM_CLASSES, per_image=True, worst_k=3)
+    for seed in range(3):
+        ms.store_results(*_fake_results(seed))
+        ms.store_measures(2, {"loss": float(seed)})
+
+    loaded = MetricStore(NUM_CLASSES, device="cpu", per_image=True, worst_k=3)
+    loaded.load_state_dict(ms.state_dict())
+    assert np.array_equal(loaded.confusion_matrix, ms.confusion_matrix)
+    assert np.array_equal(loaded.image_records, ms.image_records)
+    assert loaded.worst_images() == ms.worst_images()
+    assert loaded.summarize() == ms.summarize()
+
+
+def _all_reduce_worker(out_folder: Path):
+    init_distributed("cpu")
+    rank = get_rank()
+    # mix host and device accumulation, and different measure keys
+    ms = MetricStore(NUM_CLASSES, device="cpu" if rank == 0 else None)
+    for seed in range(rank, 4, 2):
+        ms.store_results(*_fake_results(seed))
+        ms.store_measures(2, {"loss": float(seed), f"rank{rank}": 1.0})
+    ms.all_reduce()
+    result = {
+        "cm": torch.from_numpy(ms.confusion_matrix),
+        "count_data": ms.count_data,
+        "measures": dict(ms.measures),
+    }
+    torch.save(result, out_folder / f"rank{rank}.pth")
+
+
+def test_metric_store_all_reduce(tmp_path: Path, free_port: int):
+    launch(_all_reduce_worker, 2, tmp_path, master_port=free_port)
+
+    expected = MetricStore(NUM_CLASSES)
+    for seed in range(4):
+        expected.store_results(*_fake_results(seed))
+        expected.store_measures(2, {"loss": float(seed), f"rank{seed % 2}": 1.0})
+    for rank in range(2):
+        result = torch.load(tmp_path / f"rank{rank}.pth", weights_only=True)
+        assert np.array_equal(result["cm"].numpy(), expected.confusion_matrix)
+        assert result["count_data"] == expected.count_data
+        assert result["measures"] == dict(expected.measures)
+
+
+def test_bootstrap_metrics():
+    ms = MetricStore(NUM_CLASSES, per_image=True)
+    for seed in range(5):
+        ms.store_results(*_fake_results(seed))
+
+    generator = torch.Generator().manual_seed(0)
+    intervals = bootstrap_metrics(ms.image_records, 200, generator=generator)
+    assert intervals.keys() == ms.summarize().keys()
+    for low, high in intervals.values():
+        assert 0 <= low <= high <= 1
+
+
+def test_calibration_store():
+    cs = CalibrationStore(NUM_CLASSES, num_bins=10)
+    num_valid = 0
+    for seed in range(3):
+        truths, _ = _fake_results(seed)
+        logits = torch.randn([truths.size(0), NUM_CLASSES, *truths.shape[1:]])
+        cs.store_logits(truths, logits)
+        num_valid += ((truths >= 0) & (truths < NUM_CLASSES)).sum().item()
+
+    _, _, counts = cs.reliability()
+    assert counts.sum() == num_valid
+    metrics = cs.summarize()
+    assert 0 <= metrics["ece"] <= metrics["mce"] <= 1
+
+
+def test_boundary_store():
+    truths = torch.zeros([1, 20, 20], dtype=torch.long)
+    truths[:, :, 10:] = 1
+    boundary = label_boundary(truths, 2)
+    assert boundary[0, 0].tolist() == [False] * 8 + [True] * 4 + [False] * 8
+
+    bs = BoundaryStore(NUM_CLASSES, widths=(1, 3))
+    bs.store_results(truths, truths)
+    assert all(v == 1 for v in bs.summarize().values())
+
+
+def test_fold_confusion_matrix():
+    truths, preds = _fake_results(0)
+    lut = lut_from_groups([(0, 1), (3,)], NUM_CLASSES, 2)
+    # values in results are within [-1, NUM_CLASSES], where both ends are ignored
+    lut_tensor = torch.tensor(lut + (-1,))
+    coarse_truths, coarse_preds = lut_tensor[truths], lut_tensor[preds]
+
+    cm = fast_confusion_matrix(truths, preds, NUM_CLASSES).numpy()
+    expected = fast_confusion_matrix(coarse_truths, coarse_preds, 3).numpy()
+    assert np.array_equal(fold_confusion_matrix(cm, lut, 3), expected)
+
+
+def test_batch_segmentation_augment():
+    images = torch.rand([3, 3, 40, 30])
+    masks = torch.randint(0, NUM_CLASSES, [3, 40, 30])
+    augment = BatchSegmentationAugment(mask_fill=255)
+    new_images, new_masks = augment(images, masks)
+    assert torch.equal(new_masks, masks)
+
+    augment = BatchSegmentationAugment(
+        hflip=1, blur_size=3, color_jitter=(0.1, 0.1, 0.1, 0.1), rotation_range=(90, 90)
+    )
+    new_images, new_masks = augment(images, masks)
+    assert new_images.shape == images.shape
+    # flip then rotate by 90 degrees is transposing around the center
+    assert torch.equal(new_masks[:, 5:35], masks.transpose(1, 2)[:, :, 5:35])
+    assert (new_masks[:, :5] == 255).all()
+
+
+@pytest.mark.parametrize("hflip", [0, 1])
+def test_batch_segmentation_augment_perspective(
+    monkeypatch: pytest.MonkeyPatch, hflip: int
+):
+    images = torch.rand([2, 3, 40, 30])
+    masks = torch.randint(0, NUM_CLASSES, [2, 40, 30])
+    # corners relative to center, moved differently in each sample
+    end_corners = torch.tensor(
+        [
+            [[-12, -20], [15, -17], [11, 20], [-15, 14]],
+            [[-15, -16], [13, -20], [15, 18], [-9, 20]],
+        ]
+    )
+    augment = BatchSegmentationAugment(hflip=hflip, perspective=0.5)
+    monkeypatch.setattr(augment, "_sample_corners", lambda *_: end_corners)
+    new_images, new_masks = augment(images, masks)
+
+    # same as flipping then distorting each sample with torchvision
+    startpoints = [[0, 0], [30, 0], [30, 40], [0, 40]]
+    for i in range(2):
+        endpoints = (end_corners[i] + torch.tensor([15, 20])).tolist()
+        image, mask = images[i], masks[i : i + 1]
+        if hflip:
+            image, mask = TF.horizontal_flip(image), TF.horizontal_flip(mask)
+        image = TF.perspective(image, startpoints, endpoints)
+        image = TF.normalize(image, IMAGENET_MEAN, IMAGENET_STDDEV)
+        mask = TF.perspective(
+            mask, startpoints, endpoints, InterpolationMode.NEAREST, fill=255
+        )
+        assert torch.allclose(new_images[i], image, atol=1e-3)
+        # pixels exactly on the boundary of nearest sampling may round differently
+        assert (new_masks[i] != mask[0]).float().mean() < 0.01
+
+
+def test_batch_segmentation_augment_blur():
+    images = torch.rand([3, 3, 20, 20])
+    augment = BatchSegmentationAugment(blur_size=5, blur_sigma=(0.5, 2.0))
+    # parameters are sampled on cpu from the global seed
+    torch.manual_seed(0)
+    sigmas = torch.rand(3) * 1.5 + 0.5
+    torch.manual_seed(0)
+    new_images, _ = augment(images)
+    for i, sigma in enumerate(sigmas.tolist()):
+        expected = TF.gaussian_blur(images[i], [5, 5], [sigma, sigma])
+        expected = TF.normalize(expected, IMAGENET_MEAN, IMAGENET_STDDEV)
+        assert torch.allclose(new_images[i], expected, atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "index, adjust",
+    [
+        (0, TF.adjust_brightness),
+        (1, TF.adjust_contrast),
+        (2, TF.adjust_saturation),
+        (3, TF.adjust_hue),
+    ],
+)
+def test_batch_segmentation_augment_color_jitter(index: int, adjust):
+    images = torch.rand([3, 3, 20, 20])
+    jitter = [0.0] * 4
+    jitter[index] = 0.3
+    augment = BatchSegmentationAugment(color_jitter=jitter)
+    torch.manual_seed(0)
+    torch.randperm(4)  # order of jitters
+    low, high = (-0.3, 0.3) if index == 3 else (0.7, 1.3)
+    factors = torch.rand(3) * (high - low) + low
+    torch.manual_seed(0)
+    new_images, _ = augment(images)
+    for i, factor in enumerate(factors.tolist()):
+        expected = adjust(images[i], factor)
+        expected = TF.normalize(expected, IMAGENET_MEAN, IMAGENET_STDDEV)
+        assert torch.allclose(new_images[i], expected, atol=1e-4)
+
+
+def test_batch_segmentation_augment_per_sample():
+    images = torch.rand([1, 3, 40, 30]).expand(4, -1, -1, -1)
+    masks = torch.randint(0, NUM_CLASSES, [1, 40, 30]).expand(4, -1, -1)
+    augment = BatchSegmentationAugment(
+        blur_size=5,
+        color_jitter=(0.2, 0.2, 0.2, 0.1),
+        perspective=0.5,
+        rotation_range=(-30, 30),
+    )
+    new_images, new_masks = augment(images, masks)
+    for i in range(1, 4):
+        assert not torch.allclose(new_images[0], new_images[i])
+        assert not torch.equal(new_masks[0], new_masks[i])
+
+
+def test_downsample_mask():
+    masks = torch.tensor([[[0, 0, 1, 2, 3], [0, 4, 1, 1, 3]]])
+    assert downsample_mask(masks, 2, "majority").tolist() == [[[0, 1, 3]]]
+    assert downsample_mask(masks, 2, "nearest").shape == (1, 1, 3)
+
+
+def test_augment_channels_last():
+    images = torch.rand([2, 3, 16, 24]).contiguous(memory_format=torch.channels_last)
+    masks = torch.randint(0, NUM_CLASSES, [2, 16, 24])
+    for augment in [
+        SegmentationAugment(hflip=0.5, rotation_range=(-30, 30)),
+        BatchSegmentationAugment(hflip=0.5, rotation_range=(-30, 30)),
+    ]:
+        outputs, _ = augment(images, masks)
+        assert outputs.is_contiguous(memory_format=torch.channels_last)
+        assert not outputs.is_contiguous()
+
+
+def test_overlay_masks():
+    truths, _ = _fake_results(0)
+    images = torch.rand([2, 3, 40, 30])
+    colors = [(i * 50, 255 - i * 50, 100) for i in range(NUM_CLASSES)]
+    for extra_color in (None, (255, 255, 255)):
+        overlays = overlay_masks(images, truths, colors, extra_color)
+        for image, mask, overlay in zip(images, truths, overlays):
+            expected = draw_mask_on_image(image, mask, colors, extra_color)
+            assert torch.allclose(overlay, expected, atol=1e-5)
+
+
+def test_tensor_file(tmp_path: Path):
+    state_dict = {
+        "backbone.weight": torch.rand([3, 4]).bfloat16(),
+        "backbone.num": torch.tensor(7),
+        "head.weight": torch.rand([2, 5, 2]).permute(2, 0, 1),
+        "head.mask": torch.rand([6]) > 0.5,
+        "head.empty": torch.empty([0, 3]),
+    }
+    tensor_file = tmp_path / "model.safetensors"
+    save_tensor_file(state_dict, tensor_file)
+
+    loaded = load_tensor_file(tensor_file)
+    assert loaded.keys() == state_dict.keys()
+    for k, v in state_dict.items():
+        assert loaded[k].dtype == v.dtype and torch.equal(loaded[k], v)
+    loaded["backbone.num"] += 1  # private map does not change file
+    assert load_tensor_file(tensor_file)["backbone.num"] == 7
+    backbone = load_tensor_file(tensor_file, prefixes=["backbone."])
+    assert backbone.keys() == {"backbone.weight", "backbone.num"}